@@ -2,59 +2,219 @@
 """
 3DS Starter Pack Updater GUI v2.0.0
 A graphical tool to download and organize files for 3DS custom firmware.
+
+Run with --headless for the command-line mode (see spdl_engine.py), which never
+loads tkinter or ttkbootstrap. Run with --startup-report to print how long the
+window took to appear and which imports it waited on.
 """
 
-import ttkbootstrap as ttk
-from ttkbootstrap.constants import * # NOSONAR
-from tkinter import messagebox, scrolledtext
+import builtins
+import importlib.util
 import json
 import os
 import sys
-import shutil
-import requests
-import zipfile
-import time
 import threading
-from tkinter import filedialog
-from datetime import datetime, timedelta
-
-# --- Script Constants ---
-VERSION = "2.0.0"
-CONFIG_FILE = 'gui_updater_config.json'
-CACHE_FILE = "3ds_starter_pack_cache.json"
-CACHE_DURATION = timedelta(days=1)
-
-# --- GitHub repositories and desired filename patterns ---
-REPOSITORIES = {
-    "Luma3DS": {
-        "owner": "LumaTeam",
-        "repo": "Luma3DS",
-        "download_filename_patterns": [".zip"],
-    },
-    "GodMode9": {
-        "owner": "d0k3",
-        "repo": "GodMode9",
-        "download_filename_patterns": [".zip"],
-    },
-    "Finalize": {
-        "owner": "hacks-guide",
-        "repo": "finalize",
-        "download_filename_patterns": ["x_finalize_helper.firm", "finalize.romfs"],
-    },
-}
-
-# --- Main output directory and its standard subfolders ---
-DOWNLOAD_DIR = "3DS Starter Pack"
-LUMA_DIR_NAME = "luma"
-PAYLOADS_DIR_NAME = "payloads"
-LUMA_PAYLOADS_FULL_PATH = os.path.join(DOWNLOAD_DIR, LUMA_DIR_NAME, PAYLOADS_DIR_NAME)
-GM9_DIR_FULL_PATH = os.path.join(DOWNLOAD_DIR, "gm9")
-TEMP_DIR = "temp_zip_downloads"
+import time
+from datetime import datetime
+
+from spdl_engine import VERSION, CONFIG_FILE, CACHE_FILE, DOWNLOAD_DIR, RunCancelled, UpdateEngine, load_config, clear_cache
+
+# Filled in by load_gui_modules(), so that headless runs never import Tk
+ttk = messagebox = scrolledtext = filedialog = None
+
+UI_REFRESH_HZ = 25  # How often queued log/progress/status updates are applied to the widgets
+LOG_MAX_LINES = 5000  # Overridable via 'log_max_lines' in the config file
+LOG_FILE_MAX_KB = 1024  # Size at which the optional log file ('log_file' in the config) is rotated
+LOG_FILE_BACKUPS = 3
+FIRST_PAINT_BUDGET_MS = 1000  # Startup target reported by --startup-report
+STARTUP_IMPORT_MIN_MS = 1.0  # Imports faster than this are left out of the startup report
+
+
+def load_gui_modules():
+    """Import tkinter/ttkbootstrap into this module's namespace."""
+    global ttk, messagebox, scrolledtext, filedialog
+    global X, BOTH, LEFT, TOP, W, WORD, END, NORMAL, DISABLED, CENTER
+    import ttkbootstrap as ttk
+    from ttkbootstrap.constants import X, BOTH, LEFT, TOP, W, WORD, END, NORMAL, DISABLED, CENTER
+    from tkinter import messagebox, scrolledtext, filedialog
+
+
+class StartupReport:
+    """Startup timeline for --startup-report, with per-module import times like python -X importtime.
+
+    Import times are cumulative (they include nested imports) and only cover modules
+    first imported on the main thread while tracing is on.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.imports = []
+        self.depth = 0
+        self.original_import = None
+
+    def mark(self, label):
+        self.marks.append((label, time.perf_counter() - self.start))
+
+    def trace_imports(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop_tracing(self):
+        if self.original_import:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+            return self.original_import(name, globals, locals, fromlist, level)
+        entry = [self.depth, name, 0.0]
+        self.imports.append(entry)
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.depth -= 1
+            entry[2] = time.perf_counter() - start
+
+    def lines(self):
+        """Return the report as text lines."""
+        lines = ["--- Startup report ---"]
+        for label, elapsed in self.marks:
+            lines.append(f"{elapsed * 1000:8.1f} ms  {label}")
+        first_paint = dict(self.marks).get("First paint")
+        if first_paint is not None:
+            verdict = "OK" if first_paint * 1000 <= FIRST_PAINT_BUDGET_MS else "OVER BUDGET"
+            lines.append(f"Time to first paint: {first_paint * 1000:.0f} ms "
+                         f"(budget {FIRST_PAINT_BUDGET_MS} ms): {verdict}")
+        lines.append("Imports (cumulative ms | module):")
+        for depth, name, elapsed in self.imports:
+            if elapsed * 1000 >= STARTUP_IMPORT_MIN_MS:
+                lines.append(f"{elapsed * 1000:8.1f} | {'  ' * depth}{name}")
+        return lines
+
+
+class UiUpdateChannel:
+    """Thread-safe queue of UI updates, drained by the Tk loop at a fixed frame rate.
+
+    Worker threads never touch Tk. Log lines are batched into a single insert per
+    frame, and progress/status updates are coalesced so only the latest value is
+    drawn, however fast the workers report. An update that raises is passed to
+    report_error and does not hold up the rest of the frame.
+    """
+
+    def __init__(self, root, apply_logs, apply_progress, apply_status, hz=UI_REFRESH_HZ, report_error=None):
+        self.root = root
+        self.apply_logs = apply_logs
+        self.apply_progress = apply_progress
+        self.apply_status = apply_status
+        self.report_error = report_error or (lambda message: None)
+        self.interval_ms = max(1, int(1000 / hz))
+        self.lock = threading.Lock()
+        self.logs = []
+        self.progress = None
+        self.status = None
+        self.calls = []
+        self.root.after(self.interval_ms, self._drain)
+
+    def post_log(self, line):
+        with self.lock:
+            self.logs.append(line)
+
+    def set_progress(self, value, text=""):
+        with self.lock:
+            self.progress = (value, text)
+
+    def set_status(self, text):
+        with self.lock:
+            self.status = text
+
+    def call(self, func):
+        """Run func on the Tk thread during the next frame."""
+        with self.lock:
+            self.calls.append(func)
+
+    def _drain(self):
+        # Schedule the next frame first, so a modal dialog opened by a call below
+        # (which runs a nested event loop) does not stall later updates
+        self.root.after(self.interval_ms, self._drain)
+        with self.lock:
+            logs, self.logs = self.logs, []
+            progress, self.progress = self.progress, None
+            status, self.status = self.status, None
+            calls, self.calls = self.calls, []
+        if logs:
+            self._apply(self.apply_logs, "".join(logs))
+        if progress is not None:
+            self._apply(self.apply_progress, *progress)
+        if status is not None:
+            self._apply(self.apply_status, status)
+        # Each call may be a worker blocked in _call_on_main_thread, so one failure must not drop the others
+        for func in calls:
+            self._apply(func)
+
+    def _apply(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.report_error(f"ERROR: UI update failed: {e!r}")
+
+
+class BoundedLogView:
+    """Keeps the log widget to a bounded number of lines, with an optional rotating log file.
+
+    The widget itself holds the lines; only their count is tracked here. It may hold
+    at most max_lines lines plus a small slack before the oldest lines are deleted in
+    one bulk operation, so trimming does not happen on every frame.
+    """
+
+    def __init__(self, text_widget, max_lines=LOG_MAX_LINES, log_file=None):
+        self.widget = text_widget
+        self.max_lines = max(1, max_lines)
+        self.trim_slack = max(100, self.max_lines // 10)
+        # The view can replace an earlier one once settings load, so count what the widget already holds
+        self.widget_lines = int(self.widget.index("end-1c").split(".")[0]) - 1
+        self.file_logger = None
+        if log_file:
+            import logging.handlers
+            self.file_logger = logging.getLogger("spdl.gui.log")
+            self.file_logger.setLevel(logging.INFO)
+            self.file_logger.propagate = False
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=LOG_FILE_MAX_KB * 1024, backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.file_logger.addHandler(handler)
+
+    def write_file(self, message):
+        """Append a message to the log file, if enabled. Safe to call from any thread."""
+        if self.file_logger:
+            self.file_logger.info(message.strip("\n"))
+
+    def render(self, text):
+        """Append a batch of lines to the widget and trim it in bulk. Must be called from main thread."""
+        self.widget.config(state=NORMAL)
+        self.widget.insert(END, text)
+        self.widget_lines += text.count("\n")
+        if self.widget_lines > self.max_lines + self.trim_slack:
+            excess = self.widget_lines - self.max_lines
+            self.widget.delete("1.0", f"{excess + 1}.0")
+            self.widget_lines -= excess
+        self.widget.see(END)
+        self.widget.config(state=DISABLED)
+
+    def clear(self):
+        """Empty the widget. Must be called from main thread."""
+        self.widget_lines = 0
+        self.widget.config(state=NORMAL)
+        self.widget.delete("1.0", END)
+        self.widget.config(state=DISABLED)
 
 
 class ThreeDSUpdaterGUI:
-    def __init__(self, root):
+    def __init__(self, root, startup_report=None):
         self.root = root
+        self.startup_report = startup_report
         self.root.title(f"3DS Starter Pack Downloader v{VERSION}") # NOSONAR
         self.root.geometry("770x650")
         self.root.resizable(True, True)
@@ -62,30 +222,60 @@ class ThreeDSUpdaterGUI:
         # --- Variables ---
         self.github_pat = ttk.StringVar()
         self.config_data = {}
-        self.cache_data = {}
         self.output_dir_var = ttk.StringVar()
+        self.output_dirs = []
         self.is_running = False
+        self.engine = None
+        self.update_check_thread = None
+        self.update_check_engine = None
+        self.ui_channel = UiUpdateChannel(self.root, self._apply_logs, self._apply_progress, self._apply_status,
+                                          report_error=self._report_ui_error)
 
         self.create_menu()
-        self.load_config()
         self.create_main_ui()
+        # Settings are loaded once the window has painted, so reading them never delays the first frame
+        self.root.bind("<Map>", self._on_first_map)
+
+    def _on_first_map(self, event):
+        if event.widget is not self.root:
+            return
+        self.root.unbind("<Map>")
+        self.root.after_idle(self._finish_startup)
+
+    def _finish_startup(self):
+        """Load the config and set up the log once the window is on screen."""
+        self.root.update_idletasks()
+        if self.startup_report:
+            self.startup_report.mark("First paint")
+        self.load_config()
+        self.log_view = self._create_log_view()
 
         self.log_message("Welcome to the 3DS Starter Pack Downloader!")
         self.log_message(f"Staging folder is '{DOWNLOAD_DIR}'.")
         self.log_message("Click 'Start Update' to begin.")
 
+        if self.startup_report:
+            self.startup_report.mark("Settings loaded")
+            self.startup_report.stop_tracing()
+            lines = self.startup_report.lines()
+            if sys.stderr:
+                print("\n".join(lines), file=sys.stderr)
+            for line in lines:
+                self.log_message(line)
+
+        if self.config_data.get('check_updates_on_startup', True) is not False:
+            self.start_update_check()
+
     def load_config(self):
         """Load config.json and apply settings."""
         try:
-            if os.path.exists(CONFIG_FILE):
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    self.config_data = json.load(f)
-                pat = self.config_data.get('github_pat')
-                if pat:
-                    self.github_pat.set(pat)
-                output_dir = self.config_data.get('output_dir')
-                if output_dir and os.path.isdir(output_dir):
-                    self.github_pat.set(pat)
+            self.config_data = load_config()
+            pat = self.config_data.get('github_pat')
+            if pat:
+                self.github_pat.set(pat)
+            # 'output_dir' is the single-destination setting from older versions
+            output_dirs = self.config_data.get('output_dirs') or [self.config_data.get('output_dir')]
+            self.set_output_dirs([d for d in output_dirs if d and os.path.isdir(d)])
         except (json.JSONDecodeError, IOError) as e:
             messagebox.showerror("Config Error", f"Failed to load {CONFIG_FILE}:\n{e}")
             self.config_data = {}
@@ -112,6 +302,7 @@ class ThreeDSUpdaterGUI:
         settings_menu = ttk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="Settings", menu=settings_menu)
         settings_menu.add_command(label="GitHub PAT...", command=self.show_pat_settings)
+        settings_menu.add_command(label="LAN Mirror...", command=self.show_mirror_settings)
 
     def create_main_ui(self):
         """Create the main user interface."""
@@ -122,14 +313,20 @@ class ThreeDSUpdaterGUI:
         self.start_btn = ttk.Button(controls_frame, text="Start Download", bootstyle="success", command=self.run_update_in_thread, width=15)
         self.start_btn.pack(side=LEFT, padx=5)
 
+        self.cancel_btn = ttk.Button(controls_frame, text="Cancel", bootstyle="danger-outline", command=self.cancel_update, width=8, state=DISABLED)
+        self.cancel_btn.pack(side=LEFT, padx=5)
+
         self.output_dir_btn = ttk.Button(controls_frame, text="Set Output Directory...", bootstyle="info-outline", command=self.select_output_directory)
         self.output_dir_btn.pack(side=LEFT, padx=5)
 
+        self.add_output_dir_btn = ttk.Button(controls_frame, text="Add Destination...", bootstyle="info-outline", command=self.add_output_directory)
+        self.add_output_dir_btn.pack(side=LEFT, padx=5)
+
         self.clear_cache_btn = ttk.Button(controls_frame, text="Clear Cache", bootstyle="info-outline", command=self.clear_cache)
         self.clear_cache_btn.pack(side=LEFT, padx=5)
         
         # --- Output Path Frame ---
-        output_frame = ttk.Labelframe(self.root, text="Output Destination", padding=10)
+        output_frame = ttk.Labelframe(self.root, text="Output Destination(s)", padding=10)
         output_frame.pack(fill=X, padx=10, pady=(0, 10))
 
         output_path_label = ttk.Label(output_frame, text="Path:", font=('Segoe UI', 9, 'bold'))
@@ -137,6 +334,9 @@ class ThreeDSUpdaterGUI:
         self.output_path_display = ttk.Label(output_frame, textvariable=self.output_dir_var, font=('Segoe UI', 9), wraplength=550)
         self.output_path_display.pack(side=LEFT, fill=X, expand=True)
 
+        self.clear_output_dirs_btn = ttk.Button(output_frame, text="Clear", bootstyle="secondary-outline", command=lambda: self.update_output_dirs([]))
+        self.clear_output_dirs_btn.pack(side=LEFT, padx=(5, 0))
+
         # --- Progress Frame ---
         progress_frame = ttk.Labelframe(self.root, text="Progress", padding=10)
         progress_frame.pack(fill=X, padx=10, pady=(0, 10))
@@ -148,6 +348,10 @@ class ThreeDSUpdaterGUI:
 
         self.status_label = ttk.Label(progress_frame, text="Status: Ready", font=('Segoe UI', 9))
         self.status_label.pack(side=TOP, anchor=W, pady=(5,0))
+        self.rate_limit_label = ttk.Label(progress_frame, text="GitHub API budget: unknown", font=('Segoe UI', 8))
+        self.rate_limit_label.pack(side=TOP, anchor=W, pady=(2,0))
+        self.update_check_label = ttk.Label(progress_frame, text="Updates: not checked yet", font=('Segoe UI', 8))
+        self.update_check_label.pack(side=TOP, anchor=W, pady=(2,0))
 
         # --- Log Output Frame ---
         log_frame = ttk.Labelframe(self.root, text="Log Output", padding=10)
@@ -155,31 +359,78 @@ class ThreeDSUpdaterGUI:
 
         self.log_text = scrolledtext.ScrolledText(log_frame, wrap=WORD, font=("Consolas", 9), state=DISABLED)
         self.log_text.pack(fill=BOTH, expand=True)
+        # Replaced by the configured view once settings are loaded
+        self.log_view = BoundedLogView(self.log_text)
+
+    def _create_log_view(self):
+        """Create the bounded log model from the config's 'log_max_lines' and 'log_file' settings."""
+        try:
+            max_lines = int(self.config_data.get('log_max_lines', LOG_MAX_LINES))
+        except (TypeError, ValueError):
+            max_lines = LOG_MAX_LINES
+        log_file = self.config_data.get('log_file') or None
+        try:
+            return BoundedLogView(self.log_text, max_lines=max_lines, log_file=log_file)
+        except OSError as e:
+            messagebox.showerror("Log File Error", f"Failed to open log file {log_file}:\n{e}")
+            return BoundedLogView(self.log_text, max_lines=max_lines)
 
     # --- UI Update Methods (Thread-safe) ---
     def log_message(self, message):
-        def _log():
-            self.log_text.config(state=NORMAL)
-            self.log_text.insert(END, f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n")
-            self.log_text.see(END)
-            self.log_text.config(state=DISABLED)
-        self.root.after(0, _log)
+        self.log_view.write_file(message)
+        self.ui_channel.post_log(f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n")
 
     def update_status(self, text):
-        self.root.after(0, lambda: self.status_label.config(text=f"Status: {text}"))
+        self.ui_channel.set_status(f"Status: {text}")
 
     def update_progress(self, value, text=""):
-        self.root.after(0, lambda: [
-            self.progress_bar.config(value=value),
-            self.progress_label.config(text=text)
-        ])
+        self.ui_channel.set_progress(value, text)
+
+    def update_rate_limit(self, resource, remaining, limit, reset):
+        if resource != "core":
+            return
+        reset_at = datetime.fromtimestamp(reset).strftime('%H:%M') if reset else "?"
+        text = f"GitHub API budget: {remaining}/{limit} requests left, resets at {reset_at}"
+        self.ui_channel.call(lambda: self.rate_limit_label.config(text=text))
+
+    # --- Applied by the UI channel on the Tk thread ---
+    def _report_ui_error(self, message):
+        # Not through the log widget, which may be what failed
+        self.log_view.write_file(message)
+        if sys.stderr:
+            print(message, file=sys.stderr)
+
+    def _apply_logs(self, text):
+        self.log_view.render(text)
+
+    def _apply_progress(self, value, text):
+        self.progress_bar.config(value=value)
+        self.progress_label.config(text=text)
+
+    def _apply_status(self, text):
+        self.status_label.config(text=text)
+    
+    def set_update_state(self, changes, checking=False):
+        """Show the result of an update check: {repository: [new files]}, or None if it failed."""
+        if changes is None:
+            text = "Updates: check failed"
+        elif not changes:
+            text = "Up to date"
+        else:
+            text = f"{len(changes)} update{'s' if len(changes) != 1 else ''} available: {', '.join(changes)}"
+        if checking:
+            text += " (checking...)"
+        self.ui_channel.call(lambda: self.update_check_label.config(text=text))
     
     def set_controls_state(self, state):
-        """Enable or disable control buttons. state can be NORMAL or DISABLED."""
-        self.root.after(0, lambda: [
+        """Enable or disable control buttons. state can be NORMAL or DISABLED; Cancel gets the opposite."""
+        self.ui_channel.call(lambda: [
             self.start_btn.config(state=state),
+            self.cancel_btn.config(state=DISABLED if state == NORMAL else NORMAL),
             self.clear_cache_btn.config(state=state),
-            self.output_dir_btn.config(state=state)
+            self.output_dir_btn.config(state=state),
+            self.add_output_dir_btn.config(state=state),
+            self.clear_output_dirs_btn.config(state=state)
         ])
 
     # --- Core Logic Methods ---
@@ -192,293 +443,179 @@ class ThreeDSUpdaterGUI:
         self.update_progress(0, "") # Reset progress bar
         
         # Clear log
-        self.log_text.config(state=NORMAL)
-        self.log_text.delete(1.0, END)
-        self.log_text.config(state=DISABLED)
+        self.log_view.clear()
 
         update_thread = threading.Thread(target=self.start_update_process, daemon=True)
         update_thread.start()
 
-    def start_update_process(self):
-        """The main logic for downloading and organizing files."""
+    def cancel_update(self):
+        """Ask the running update to stop. It finishes the block it is working on and cleans up."""
+        engine = self.engine
+        if not (self.is_running and engine):
+            return
+        self.cancel_btn.config(state=DISABLED)
+        self.log_message("Cancelling... (waiting for the current step to stop)")
+        self.update_status("Cancelling...")
+        engine.cancel()
+        check_engine = self.update_check_engine
+        if self.update_check_thread and self.update_check_thread.is_alive() and check_engine:
+            # The update may still be waiting for the background check to finish
+            check_engine.cancel()
+
+    # --- Background update check ---
+    def start_update_check(self, download=None):
+        """Check for new releases in a background thread, showing the cached answer first.
+
+        download=None pre-downloads new assets if 'prefetch_assets' is set in the config.
+        """
+        if self.update_check_thread and self.update_check_thread.is_alive():
+            return
+        if download is None:
+            download = self.config_data.get('prefetch_assets') is True
+        self.update_check_thread = threading.Thread(
+            target=self._check_for_updates, args=(dict(self.config_data), self.github_pat.get(), download),
+            name="spdl-update-check", daemon=True)
+        self.update_check_thread.start()
+
+    def _check_for_updates(self, config, token, download):
+        engine = UpdateEngine(config=config, token=token, rate_limit=self.update_rate_limit)
+        # Kept so Cancel can stop a check that a starting update is waiting for
+        self.update_check_engine = engine
         try:
-            self.log_message("Starting update process...")
-            self.update_status("Loading cache...")
-            
-            self.cache_data = self._load_cache()
-            
-            os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-            os.makedirs(TEMP_DIR, exist_ok=True)
-            self.log_message(f"Created staging directories: '{DOWNLOAD_DIR}/' and '{TEMP_DIR}/'.")
-
-            all_downloaded_items = []
-
-            for name, details in REPOSITORIES.items():
-                self.log_message(f"\n--- Processing {name} ---")
-                self.update_status(f"Fetching info for {name}...")
-                urls, filenames = self._get_latest_release_asset_urls(
-                    details["owner"], details["repo"], details["download_filename_patterns"]
-                )
-
-                if urls and filenames:
-                    for url, filename in zip(urls, filenames):
-                        self.update_status(f"Downloading {filename}...")
-                        temp_filepath = self._download_file(url, filename, TEMP_DIR)
-                        if temp_filepath:
-                            is_zip_file = filename.lower().endswith(".zip")
-                            all_downloaded_items.append((name, filename, temp_filepath, is_zip_file))
-                        else:
-                            self.log_message(f"ERROR: Failed to download {filename} for {name}.")
-                            self.log_message(f"Manually download from https://github.com/{details['owner']}/{details['repo']}/releases")
-                else:
-                    self.log_message(f"Could not find suitable assets to download for {name}.")
-                    self.log_message(f"Manually download from https://github.com/{details['owner']}/{details['repo']}/releases")
-                time.sleep(1)
-
-            # --- File Organization ---
-            self.log_message("\n--- All downloads complete. Organizing files... ---")
-            self.update_status("Organizing files...")
-            os.makedirs(LUMA_PAYLOADS_FULL_PATH, exist_ok=True)
-            os.makedirs(GM9_DIR_FULL_PATH, exist_ok=True)
-
-            for name, original_filename, temp_filepath, is_zip_file in all_downloaded_items:
-                self._organize_file(name, original_filename, temp_filepath, is_zip_file)
-
-            # --- Verification and Cleanup ---
-            self.log_message("\n--- Verifying critical files... ---")
-            self._verify_files()
-            
-            if os.path.exists(TEMP_DIR):
-                try:
-                    shutil.rmtree(TEMP_DIR)
-                    self.log_message(f"\nRemoved temporary directory: {TEMP_DIR}")
-                except Exception as e:
-                    self.log_message(f"ERROR: Could not remove temporary directory {TEMP_DIR}: {e}")
-            
-            # --- Final Copy to Destination ---
-            self._copy_to_destination()
-
-            self.log_message("\n════════════════════════════════════════════")
-            self.log_message("Update and organization complete!")
-            if not self.output_dir_var.get():
-                self.log_message(f"The '{DOWNLOAD_DIR}' folder is ready.")
-                self.log_message("Copy its contents to the root of your SD card.")
-            self.update_status("Complete!")
-            
-            
+            # Stale cache entries answer right away; revalidating them happens while the user looks
+            self.set_update_state(engine.check_for_updates(revalidate=False), checking=True)
+            changes = engine.check_for_updates(download=download)
+        except RunCancelled as e:
+            self.log_message(f"Background update check stopped: {e}")
+            self.set_update_state(None)
+            return
         except Exception as e:
-            self.log_message(f"\nFATAL ERROR: An unexpected error occurred: {e}")
-            self.update_status("Error!")
+            self.log_message(f"Background update check failed: {e}")
+            self.set_update_state(None)
+            return
+        self.set_update_state(changes)
+        for name, filenames in changes.items():
+            self.log_message(f"Update available for {name}: {', '.join(filenames) or 'release info not cached yet'}")
+        if engine.run_manifest["assets"]:
+            self.log_message(f"Downloaded {len(engine.run_manifest['assets'])} new file(s) in the background; "
+                             "they will be installed from the local store.")
+
+    def start_update_process(self):
+        """Run the update engine, reporting into the GUI."""
+        engine = UpdateEngine(
+            config=self.config_data,
+            token=self.github_pat.get(),
+            output_dirs=self.output_dirs,
+            log=self.log_message,
+            status=self.update_status,
+            progress=self.update_progress,
+            # The confirmation dialog needs to run on the main thread
+            confirm=lambda plans: self._call_on_main_thread(self._confirm_sync, plans, cancel_token=engine.cancel_token),
+            error=lambda title, message: self.ui_channel.call(lambda: self.show_custom_info(title, message, width=500, height=220)),
+            rate_limit=self.update_rate_limit,
+        )
+        # Set before waiting for the update check, so Cancel works from the first click
+        self.engine = engine
+        try:
+            if self.update_check_thread and self.update_check_thread.is_alive():
+                # Its revalidated release info and downloads are what this run will use
+                self.update_status("Finishing the background update check...")
+                self.update_check_thread.join()
+            engine.run()
         finally:
+            self.engine = None
             self.is_running = False
             self.set_controls_state(NORMAL)
-            
+            # Refresh the update state; the cache is fresh now, so this stays offline
+            self.ui_channel.call(lambda: self.start_update_check(download=False))
+
     def select_output_directory(self):
-        """Open a dialog to select the final output directory."""
+        """Open a dialog to select the final output directory, replacing any others."""
         directory = filedialog.askdirectory(title="Select Output Directory (e.g., your SD card root)")
         if directory:
-            self.output_dir_var.set(directory)
-            self.config_data['output_dir'] = directory
-            self.save_config()
+            self.update_output_dirs([directory])
             self.log_message(f"Output directory set to: {directory}")
 
-    def _load_cache(self):
-        """Load cached release data from file."""
-        try:
-            if os.path.exists(CACHE_FILE):
-                with open(CACHE_FILE, 'r') as f:
-                    return json.load(f)
-        except Exception as e:
-            self.log_message(f"Error loading cache: {e}")
-        return {}
-    
-    def _save_cache(self):
-        """Save release data to cache file."""
-        try:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(self.cache_data, f, indent=4)
-            self.log_message(f"Updated cache in {CACHE_FILE}")
-        except Exception as e:
-            self.log_message(f"Error saving cache: {e}")
-    
+    def add_output_directory(self):
+        """Open a dialog to add another destination, e.g. for writing several SD cards at once."""
+        directory = filedialog.askdirectory(title="Add Output Directory (e.g., another SD card root)")
+        if directory and directory not in self.output_dirs:
+            self.update_output_dirs(self.output_dirs + [directory])
+            self.log_message(f"Added output directory: {directory} ({len(self.output_dirs)} destinations)")
+
+    def set_output_dirs(self, output_dirs):
+        """Set the destinations and refresh their display."""
+        self.output_dirs = list(output_dirs)
+        self.output_dir_var.set("\n".join(self.output_dirs))
+
+    def update_output_dirs(self, output_dirs):
+        """Set the destinations and save them to the config file."""
+        self.set_output_dirs(output_dirs)
+        self.config_data['output_dirs'] = self.output_dirs
+        self.config_data.pop('output_dir', None)
+        self.save_config()
+
     def clear_cache(self):
-        if os.path.exists(CACHE_FILE):
-            try:
-                os.remove(CACHE_FILE)
-                self.cache_data = {}
-                self.log_message(f"Cache file '{CACHE_FILE}' cleared successfully.")
-                self.show_custom_info("Success", f"Cache file '{CACHE_FILE}' has been cleared.", width=400)
-            except OSError as e:
-                self.log_message(f"Error clearing cache: {e}")
-                self.show_custom_info("Error", f"Failed to clear cache:\n{e}", width=400)
+        try:
+            cleared = clear_cache()
+        except OSError as e:
+            self.log_message(f"Error clearing cache: {e}")
+            self.show_custom_info("Error", f"Failed to clear cache:\n{e}", width=400)
+            return
+        if cleared:
+            self.log_message(f"Cache file '{CACHE_FILE}' and stored assets cleared successfully.")
+            self.show_custom_info("Success", f"Cache file '{CACHE_FILE}' and stored assets have been cleared.", width=400)
         else:
             self.log_message("No cache file to clear.")
             self.show_custom_info("Info", "No cache file found to clear.", width=350)
 
-    def _get_latest_release_asset_urls(self, owner, repo, patterns, retry_count=3):
-        """Fetches all matching assets from the latest release, using cache if available."""
-        cache_key = f"{owner}/{repo}"
-        current_time = datetime.utcnow()
-        
-        if cache_key in self.cache_data:
-            cache_entry = self.cache_data[cache_key]
-            try:
-                cache_time = datetime.fromisoformat(cache_entry["timestamp"])
-                if current_time - cache_time < CACHE_DURATION:
-                    self.log_message(f"Using cached data for {owner}/{repo}")
-                    return cache_entry.get("urls", []), cache_entry.get("filenames", [])
-            except ValueError:
-                self.log_message(f"Invalid cache timestamp for {owner}/{repo}, fetching new data")
-
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
-        headers = {"Accept": "application/vnd.github.com.v3+json"}
-        token = self.github_pat.get()
-        if token:
-            headers["Authorization"] = f"Bearer {token}"
-        if cache_key in self.cache_data and "etag" in self.cache_data[cache_key]:
-            headers["If-None-Match"] = self.cache_data[cache_key]["etag"]
-        
-        try:
-            response = requests.get(api_url, headers=headers)
-            if response.status_code == 304:
-                self.log_message(f"No changes for {owner}/{repo} (ETag match), using cached data.")
-                return self.cache_data[cache_key].get("urls", []), self.cache_data[cache_key].get("filenames", [])
-
-            response.raise_for_status()
-            release_data = response.json()
-            assets = release_data.get("assets", [])
-            
-            urls, filenames = [], []
-            for pattern in patterns:
-                for asset in assets:
-                    if asset["name"].lower().endswith(pattern.lower()):
-                        self.log_message(f"Found asset for {owner}/{repo}: {asset['name']}")
-                        urls.append(asset["browser_download_url"])
-                        filenames.append(asset["name"])
-            
-            if urls:
-                self.cache_data[cache_key] = {
-                    "urls": urls,
-                    "filenames": filenames,
-                    "timestamp": current_time.isoformat(),
-                    "etag": response.headers.get("ETag", "")
-                }
-                self._save_cache()
-                return urls, filenames
-            else:
-                self.log_message(f"No asset found matching patterns {patterns} for {owner}/{repo}.")
-                return [], []
-
-        except requests.exceptions.RequestException as e:
-            self.log_message(f"ERROR fetching release for {owner}/{repo}: {e}")
-            return [], []
-
-    def _download_file(self, url, filename, download_path):
-        """Downloads a file, updating the GUI with progress."""
-        try:
-            self.log_message(f"Downloading {filename}...")
-            headers = {"Accept": "application/octet-stream"}
-            token = self.github_pat.get()
-            if token:
-                headers["Authorization"] = f"Bearer {token}"
-            
-            response = requests.get(url, headers=headers, stream=True)
-            response.raise_for_status()
-
-            total_size = int(response.headers.get('content-length', 0))
-            filepath = os.path.join(download_path, filename)
-            downloaded_size = 0
-
-            with open(filepath, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        progress_text = f"{filename} - {downloaded_size/1024/1024:.2f} MB / {total_size/1024/1024:.2f} MB"
-                        self.update_progress(progress, progress_text)
-            
-            self.log_message(f"Successfully downloaded {filename}")
-            return filepath
-        except requests.exceptions.RequestException as e:
-            self.log_message(f"Error downloading {filename}: {e}")
-            return None
-
-    def _organize_file(self, name, original_filename, temp_filepath, is_zip_file):
-        """Organizes a single downloaded file."""
-        self.log_message(f"Organizing: {original_filename}")
-        try:
-            if not os.path.exists(temp_filepath):
-                self.log_message(f"Skipping {original_filename}: Temporary file not found.")
-                return
-
-            if is_zip_file:
-                with zipfile.ZipFile(temp_filepath, 'r') as zf:
-                    if name == "GodMode9":
-                        for member in zf.namelist():
-                            if os.path.basename(member).lower() == "godmode9.firm":
-                                zf.extract(member, TEMP_DIR)
-                                shutil.move(os.path.join(TEMP_DIR, member), os.path.join(LUMA_PAYLOADS_FULL_PATH, "GodMode9.firm"))
-                                self.log_message(f"Extracted GodMode9.firm to {LUMA_PAYLOADS_FULL_PATH}")
-                            elif "gm9/scripts/" in member:
-                                zf.extract(member, DOWNLOAD_DIR)
-                                self.log_message(f"Extracted {member} to {DOWNLOAD_DIR}")
-                    elif name == "Luma3DS":
-                        zf.extractall(DOWNLOAD_DIR)
-                        self.log_message(f"Extracted Luma3DS contents to {DOWNLOAD_DIR}.")
-                os.remove(temp_filepath)
-            else:
-                final_dest_path = LUMA_PAYLOADS_FULL_PATH if original_filename.lower().endswith(".firm") else DOWNLOAD_DIR
-                shutil.move(temp_filepath, os.path.join(final_dest_path, original_filename))
-                self.log_message(f"Moved '{original_filename}' to '{os.path.basename(final_dest_path)}/' folder.")
-
-        except Exception as e:
-            self.log_message(f"Error during organization of {original_filename}: {e}.")
-    
-    def _verify_files(self):
-        """Verifies that critical files exist in their final locations."""
-        files_to_check = {
-            "GodMode9.firm": os.path.join(LUMA_PAYLOADS_FULL_PATH, "GodMode9.firm"),
-            "Luma's boot.firm": os.path.join(DOWNLOAD_DIR, "boot.firm"),
-            "x_finalize_helper.firm": os.path.join(LUMA_PAYLOADS_FULL_PATH, "x_finalize_helper.firm"),
-            "finalize.romfs": os.path.join(DOWNLOAD_DIR, "finalize.romfs")
-        }
-        for name, path in files_to_check.items():
-            if os.path.exists(path):
-                self.log_message(f"Verification: {name} found. OK.")
-            else:
-                self.log_message(f"WARNING: {name} NOT FOUND. Manual check needed!")
-
-    def _copy_to_destination(self):
-        """Copy the contents of the staging directory to the user-selected destination."""
-        destination_dir = self.output_dir_var.get()
-        if not destination_dir or not os.path.isdir(destination_dir):
-            return
-
-        self.log_message(f"\n--- Copying files to {destination_dir} ---")
-        self.update_status("Copying to destination...")
+    def _call_on_main_thread(self, func, *args, cancel_token=None):
+        """Run func on the Tk main thread and block the calling worker thread until it returns.
 
-        # This needs to run on the main thread for the messagebox to work correctly
-        self.root.after(0, self._confirm_and_copy, destination_dir)
+        Returns None if func raised, or if cancel_token is cancelled before func has returned.
+        """
+        done = threading.Event()
+        result = []
 
-    def _confirm_and_copy(self, destination_dir):
-        """Show confirmation and perform the copy. Must be called from main thread."""
+        def run():
+            try:
+                result.append(func(*args))
+            finally:
+                done.set()
+
+        self.ui_channel.call(run)
+        while not done.wait(self.ui_channel.interval_ms / 1000):
+            if cancel_token and cancel_token.is_cancelled():
+                return None
+        return result[0] if result else None
+
+    def _confirm_sync(self, plans):
+        """Show the sync plan for each destination and ask for confirmation. Must be called from main thread."""
+        mb = 1024 * 1024
+        if len(plans) == 1:
+            destination_dir, plan = next(iter(plans.items()))
+            preview = "\n".join(f"  {reason}: {rel_path}" for rel_path, _, _, reason in plan["copy"][:8])
+            if len(plan["copy"]) > 8:
+                preview += f"\n  ...and {len(plan['copy']) - 8} more"
+            summary = (
+                f"This will merge the contents of '{DOWNLOAD_DIR}' into '{destination_dir}'.\n\n"
+                f"• {len(plan['copy'])} file(s) will be written ({plan['bytes_to_write']/mb:.2f} MB):\n{preview}\n"
+                f"• {len(plan['skip'])} unchanged file(s) will be skipped ({plan['bytes_skipped']/mb:.2f} MB).\n")
+        else:
+            lines = "\n".join(
+                f"  {destination_dir}: {len(plan['copy'])} file(s), {plan['bytes_to_write']/mb:.2f} MB to write, "
+                f"{plan['bytes_skipped']/mb:.2f} MB skipped"
+                for destination_dir, plan in list(plans.items())[:8])
+            if len(plans) > 8:
+                lines += f"\n  ...and {len(plans) - 8} more"
+            summary = (
+                f"This will merge the contents of '{DOWNLOAD_DIR}' into {len(plans)} destinations in parallel.\n\n"
+                f"{lines}\n\n")
         confirm_message = (
-            f"This will merge the contents of '{DOWNLOAD_DIR}' into '{destination_dir}'.\n\n"
-            "• New files will be added.\n"
-            "• Existing files will be updated/overwritten.\n"
+            summary +
             "• Other files on the destination will NOT be deleted.\n\n"
             "Do you want to proceed?")
-        if self.show_custom_confirm("Confirm Merge", confirm_message, width=550, height=400):
-            try:
-                # shutil.copytree with dirs_exist_ok=True is perfect for this
-                shutil.copytree(DOWNLOAD_DIR, destination_dir, dirs_exist_ok=True)
-                self.log_message(f"Successfully copied files to {destination_dir}")
-                self.update_status("Copy complete!")
-            except Exception as e:
-                self.log_message(f"ERROR: Failed to copy files to destination: {e}")
-                self.update_status("Copy failed!")
-                self.show_custom_info("Copy Error", f"Failed to copy files to '{destination_dir}':\n{e}", width=500, height=220)
+        return self.show_custom_confirm("Confirm Merge", confirm_message, width=550, height=450)
 
     # --- Helper Methods from hatskitpro.py ---
     def show_pat_settings(self):
@@ -522,6 +659,44 @@ class ThreeDSUpdaterGUI:
         pat_dialog.update_idletasks()
         self.center_window(pat_dialog)
 
+    def show_mirror_settings(self):
+        """Show the LAN mirror settings dialog."""
+        mirror_dialog = ttk.Toplevel(self.root)
+        mirror_dialog.title("LAN Mirror")
+        mirror_dialog.geometry("500x300")
+        mirror_dialog.transient(self.root)
+        mirror_dialog.grab_set()
+
+        info_frame = ttk.Frame(mirror_dialog, padding=20)
+        info_frame.pack(fill=BOTH, expand=True)
+
+        ttk.Label(info_frame, text="LAN Mirror", font=('Segoe UI', 11, 'bold')).pack(pady=(0, 10))
+        ttk.Label(info_frame, text="Fetch release info and files from another station running\n"
+                                   "'3DS-SPDL --headless --serve-mirror' before asking GitHub.\n"
+                                   "Leave empty to always use GitHub.", wraplength=450).pack(pady=(0, 15))
+
+        ttk.Label(info_frame, text="Mirror URL (e.g. http://bench-1:8765):").pack(anchor=W)
+        mirror_url = ttk.StringVar(value=self.config_data.get('mirror_url', ""))
+        ttk.Entry(info_frame, textvariable=mirror_url, width=50).pack(fill=X, pady=5)
+
+        button_frame = ttk.Frame(info_frame)
+        button_frame.pack(pady=(15, 0))
+
+        def save_mirror():
+            url = mirror_url.get().strip()
+            if url:
+                self.config_data['mirror_url'] = url
+            else:
+                self.config_data.pop('mirror_url', None)
+            self.save_config()
+            mirror_dialog.destroy()
+
+        ttk.Button(button_frame, text="Save", command=save_mirror, bootstyle="primary").pack(side=LEFT, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=mirror_dialog.destroy, bootstyle="secondary").pack(side=LEFT, padx=5)
+
+        mirror_dialog.update_idletasks()
+        self.center_window(mirror_dialog)
+
     def show_custom_info(self, title, message, parent=None, width=400, height=200):
         """Show a custom centered info dialog."""
         parent_window = parent if parent else self.root
@@ -594,19 +769,35 @@ class ThreeDSUpdaterGUI:
 
 
 def main():
-    # Ensure required packages are installed (simple check)
+    if "--headless" in sys.argv[1:]:
+        import spdl_engine
+        sys.exit(spdl_engine.main(sys.argv[1:]))
+
+    startup_report = StartupReport() if "--startup-report" in sys.argv[1:] else None
+    if startup_report:
+        startup_report.trace_imports()
+
+    # Ensure required packages are installed (simple check). requests itself is only
+    # imported when the first update starts.
     try:
-        import requests
-        import ttkbootstrap
+        load_gui_modules()
+        if importlib.util.find_spec("requests") is None:
+            raise ImportError("requests")
     except ImportError:
         print("Required packages 'requests' or 'ttkbootstrap' not found.")
         print("Please install them using: pip install requests ttkbootstrap")
         sys.exit(1)
 
+    if startup_report:
+        startup_report.mark("GUI modules imported")
     root = ttk.Window(themename="darkly")
-    app = ThreeDSUpdaterGUI(root)
+    if startup_report:
+        startup_report.mark("Window created")
+    app = ThreeDSUpdaterGUI(root, startup_report=startup_report)
+    if startup_report:
+        startup_report.mark("Widgets built")
     root.mainloop()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
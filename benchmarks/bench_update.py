@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the 3DS Starter Pack updater.
+
+Starts a local stand-in for the GitHub releases API and asset CDN, points
+spdl_engine at it and runs the full fetch -> download -> organize -> verify ->
+copy flow for a series of scenarios:
+
+  cold        empty working directory: every lookup and download goes to the server
+  revalidate  cache expired, so every lookup is a conditional request (304 if ETags are on)
+  warm        fresh cache and populated asset store: no network traffic expected
+  replaced    an asset is replaced on the server while a partial download of it is
+              journaled, so the run must notice the resume no longer fits
+
+Results (wall time, throughput, bytes served, UI callbacks and peak RSS, per
+phase and per scenario) are printed and written as JSON.
+
+Usage: python benchmarks/bench_update.py --latency 50 --bandwidth 2048 --asset-size 4 -o results.json
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import spdl_engine  # noqa: E402
+
+SCENARIOS = ("cold", "revalidate", "warm", "replaced")
+DEFAULT_SCENARIOS = ("cold", "revalidate", "warm")
+REPLACED_ASSET = "hacks-guide/finalize/finalize.romfs"  # Asset the replaced scenario swaps out; overridable via --replace-asset
+RSS_SAMPLE_INTERVAL = 0.02  # Seconds between resident memory samples
+SEND_CHUNK_SIZE = 16 * 1024
+
+# Engine status messages mark the start of each phase. Organizing and verifying run
+# inside the download pipeline, so their time is attributed to the phase they interleave with.
+PHASES = (
+    ("Loading cache", "setup"),
+    ("Fetching release info", "fetch"),
+    ("Downloading", "download"),
+    ("Organizing", "organize"),
+    ("Comparing with destination", "copy"),
+    ("Copying to", "copy"),
+    ("Destination(s) already up to date", "copy"),
+)
+
+
+def build_assets(asset_size_mb):
+    """Build release assets shaped like the real ones, each padded with random payload data."""
+    payload_size = int(asset_size_mb * 1024 * 1024)
+    rng = random.Random(3)
+
+    def payload():
+        return rng.getrandbits(8 * payload_size).to_bytes(payload_size, "little") if payload_size else b""
+
+    def make_zip(files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    return {
+        "LumaTeam/Luma3DS": {"Luma3DSv13.zip": make_zip({"boot.firm": payload(), "README.md": b"Luma3DS"})},
+        "d0k3/GodMode9": {"GodMode9-v2.zip": make_zip({
+            "GodMode9.firm": payload(),
+            "gm9/scripts/GM9Megascript.gm9": b"# script",
+            "gm9/scripts/cleanup.gm9": b"# script",
+            "README.md": b"GodMode9",
+        })},
+        "hacks-guide/finalize": {"x_finalize_helper.firm": payload(), "finalize.romfs": payload()},
+    }
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections mid-download is expected with --drop-rate
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeGitHub:
+    """Threaded HTTP server that imitates the GitHub REST/GraphQL APIs and release downloads.
+
+    latency is added to every request, bandwidth (bytes/s, 0 for unlimited) throttles
+    downloads per connection, and fail_rate/drop_rate inject HTTP 500s and truncated
+    downloads respectively. With if_range=False, range requests get a 206 even when
+    If-Range no longer matches, like servers that ignore the header.
+    """
+
+    def __init__(self, assets, latency=0.0, bandwidth=0, etags=True, fail_rate=0.0, drop_rate=0.0, seed=0,
+                 if_range=True):
+        self.assets = assets
+        self.revisions = {}
+        self.cut_off = None
+        self.if_range = if_range
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.etags = etags
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.reset_stats()
+        self.server = QuietHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-github", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "api_requests": 0, "not_modified": 0, "downloads": 0,
+                          "failures_injected": 0, "bytes_sent": 0}
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def inject(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def replace_asset(self, repository, name):
+        """Replace an asset with new content of the same size, as re-uploading it to a release would.
+
+        The download URL stays the same; the asset id, digest and ETag change.
+        """
+        with self.lock:
+            data = self.assets[repository][name]
+            self.assets[repository][name] = data[1:] + data[:1]
+            self.revisions[(repository, name)] = self.revisions.get((repository, name), 0) + 1
+
+    def asset_id(self, repository, name):
+        # Asset ids are unique across all of GitHub, not just within a release
+        revision = self.revisions.get((repository, name), 0)
+        key = f"{repository}/{name}" + (f"#{revision}" if revision else "")
+        return int(hashlib.sha1(key.encode()).hexdigest()[:8], 16)
+
+    def release_json(self, repository):
+        assets = [{
+            "id": self.asset_id(repository, name),
+            "name": name,
+            "size": len(data),
+            "browser_download_url": f"{self.url}/download/{repository}/{name}",
+            "digest": f"sha256:{hashlib.sha256(data).hexdigest()}",
+        } for name, data in self.assets[repository].items()]
+        return {"tag_name": "v1.0", "assets": assets}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_body(self, status, body, headers=()):
+                self.send_response(status)
+                for key, value in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                fake.count("bytes_sent", len(body))
+
+            def do_GET(self):
+                fake.count("requests")
+                time.sleep(fake.latency)
+                parts = self.path.strip("/").split("/")
+                if parts[0] == "repos" and len(parts) >= 5:
+                    self.release(f"{parts[1]}/{parts[2]}")
+                elif parts[0] == "download" and len(parts) >= 4:
+                    self.download(f"{parts[1]}/{parts[2]}", parts[3])
+                else:
+                    self.send_body(404, b'{"message": "Not Found"}')
+
+            def do_POST(self):
+                fake.count("requests")
+                fake.count("api_requests")
+                time.sleep(fake.latency)
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                variables = body.get("variables", {})
+                data, index = {}, 0
+                while f"owner{index}" in variables:
+                    repository = f"{variables[f'owner{index}']}/{variables[f'name{index}']}"
+                    release = fake.release_json(repository) if repository in fake.assets else None
+                    data[f"r{index}"] = {"latestRelease": release and {
+                        "tagName": release["tag_name"],
+                        "releaseAssets": {"nodes": [
+                            {"id": f"RA_{asset['id']}", "databaseId": asset["id"], "name": asset["name"],
+                             "downloadUrl": asset["browser_download_url"], "size": asset["size"],
+                             "digest": asset["digest"]}
+                            for asset in release["assets"]]},
+                    }}
+                    index += 1
+                self.send_body(200, json.dumps({"data": data}).encode(), [("Content-Type", "application/json")])
+
+            def release(self, repository):
+                fake.count("api_requests")
+                if repository not in fake.assets:
+                    self.send_body(404, b'{"message": "Not Found"}')
+                    return
+                body = json.dumps(fake.release_json(repository)).encode()
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                headers = [("Content-Type", "application/json"),
+                           ("X-RateLimit-Limit", "5000"), ("X-RateLimit-Remaining", "4999"),
+                           ("X-RateLimit-Reset", str(int(time.time()) + 3600))]
+                if fake.etags:
+                    headers.append(("ETag", etag))
+                    if self.headers.get("If-None-Match") == etag:
+                        fake.count("not_modified")
+                        self.send_body(304, b"", headers)
+                        return
+                self.send_body(200, body, headers)
+
+            def download(self, repository, name):
+                data = fake.assets.get(repository, {}).get(name)
+                if data is None:
+                    self.send_body(404, b"Not Found")
+                    return
+                if fake.inject(fake.fail_rate):
+                    fake.count("failures_injected")
+                    self.send_body(500, b"Injected failure")
+                    return
+                fake.count("downloads")
+
+                etag = f'"{hashlib.sha1(data).hexdigest()}"'
+                start, end, status = 0, len(data) - 1, 200
+                range_header = self.headers.get("Range", "")
+                if_range = self.headers.get("If-Range")
+                if range_header.startswith("bytes=") and (not fake.if_range or if_range in (None, etag)):
+                    first, _, last = range_header[6:].split(",")[0].strip().partition("-")
+                    if not first:  # Suffix range: the last N bytes
+                        start = max(0, len(data) - int(last))
+                    else:
+                        start, end = int(first), min(int(last), len(data) - 1) if last else len(data) - 1
+                    if start >= len(data) or start > end:
+                        self.send_body(416, b"", [("Content-Range", f"bytes */{len(data)}")])
+                        return
+                    status = 206
+                body = data[start:end + 1]
+                cut_off = fake.cut_off and fake.cut_off[0] == (repository, name)
+                drop = cut_off or fake.inject(fake.drop_rate)
+                if drop and not cut_off:
+                    fake.count("failures_injected")
+
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("ETag", etag)
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+                self.end_headers()
+
+                limit = len(body) // 2 if drop else len(body)
+                sent = 0
+                while sent < limit:
+                    chunk = body[sent:min(sent + SEND_CHUNK_SIZE, limit)]
+                    chunk_start = time.monotonic()
+                    try:
+                        self.wfile.write(chunk)
+                    except OSError:
+                        break
+                    sent += len(chunk)
+                    fake.count("bytes_sent", len(chunk))
+                    if fake.bandwidth:
+                        time.sleep(max(0.0, len(chunk) / fake.bandwidth - (time.monotonic() - chunk_start)))
+                if cut_off:
+                    # Give the client time to write what it got before its run is stopped
+                    self.wfile.flush()
+                    time.sleep(0.2)
+                    fake.cut_off[1]()
+                if drop:
+                    self.close_connection = True
+
+        return Handler
+
+
+def current_rss():
+    """Return this process's resident set size in bytes, or None if it can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # Without /proc only the lifetime peak is available (kilobytes on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PhaseRecorder:
+    """Attribute wall time, bytes served, UI callbacks and peak RSS to engine phases.
+
+    Phases switch when the engine reports a status listed in PHASES. A background
+    thread samples RSS so each phase gets its own peak.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.phase = None
+        self.phase_start = None
+        self.bytes_at_start = 0
+        self.callbacks = {"log": 0, "status": 0, "progress": 0, "rate_limit": 0}
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.switch("setup")
+        self.sampler.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.sampler.join()
+        self.switch(None)
+        return time.perf_counter() - self.started
+
+    def _phase_entry(self, name):
+        return self.phases.setdefault(name, {"wall_s": 0.0, "bytes": 0, "ui_callbacks": 0, "peak_rss_mb": 0.0})
+
+    def _sample(self):
+        while not self.stop_event.wait(RSS_SAMPLE_INTERVAL):
+            rss = current_rss()
+            if rss is None:
+                return
+            with self.lock:
+                if self.phase:
+                    entry = self._phase_entry(self.phase)
+                    entry["peak_rss_mb"] = max(entry["peak_rss_mb"], rss / 1024 / 1024)
+
+    def switch(self, phase):
+        now = time.perf_counter()
+        sent = self.server.snapshot()["bytes_sent"]
+        with self.lock:
+            if phase == self.phase:
+                return
+            if self.phase:
+                entry = self._phase_entry(self.phase)
+                entry["wall_s"] += now - self.phase_start
+                entry["bytes"] += sent - self.bytes_at_start
+            self.phase, self.phase_start, self.bytes_at_start = phase, now, sent
+
+    def callback(self, kind):
+        with self.lock:
+            self.callbacks[kind] += 1
+            if self.phase:
+                self._phase_entry(self.phase)["ui_callbacks"] += 1
+
+    # --- Engine callbacks ---
+    def log(self, message):
+        self.callback("log")
+
+    def status(self, text):
+        self.callback("status")
+        for prefix, phase in PHASES:
+            if text.startswith(prefix):
+                self.switch(phase)
+                break
+
+    def progress(self, value, text=""):
+        self.callback("progress")
+
+    def rate_limit(self, resource, remaining, limit, reset):
+        self.callback("rate_limit")
+
+    def report(self):
+        phases = {}
+        for name, entry in self.phases.items():
+            phases[name] = dict(entry, wall_s=round(entry["wall_s"], 4), peak_rss_mb=round(entry["peak_rss_mb"], 1),
+                                throughput_mbps=round(entry["bytes"] / 1024 / 1024 / entry["wall_s"], 2)
+                                if entry["wall_s"] else 0.0)
+        return phases
+
+
+def expire_cache(cache_file):
+    """Age every cache entry past CACHE_DURATION so the next run revalidates it."""
+    cache = spdl_engine.MetadataCache(cache_file)
+    stale = (datetime.utcnow() - spdl_engine.CACHE_DURATION - timedelta(minutes=1)).isoformat()
+    for key, entry in list(cache.load().items()):
+        cache.put(key, dict(entry, timestamp=stale))
+    cache.flush()
+
+
+def leave_stale_partial(server, config, token, asset):
+    """Replace an asset, stop a run halfway through downloading it, then replace it again.
+
+    The next run finds a journaled partial download whose validators no longer match
+    the server's copy.
+    """
+    repository, _, name = asset.rpartition("/")
+    server.replace_asset(repository, name)
+    expire_cache(spdl_engine.CACHE_FILE)
+    engine = spdl_engine.UpdateEngine(config=config, token=token, log=lambda message: None)
+    server.cut_off = ((repository, name), engine.cancel)
+    try:
+        engine.run()
+    finally:
+        server.cut_off = None
+    server.replace_asset(repository, name)
+
+
+def run_scenario(name, server, config, token, destination, replaced_asset=REPLACED_ASSET):
+    """Run the engine once against the fake server and return the scenario's measurements."""
+    if name == "replaced":
+        leave_stale_partial(server, config, token, replaced_asset)
+    if name in ("revalidate", "replaced") and os.path.exists(spdl_engine.CACHE_FILE):
+        expire_cache(spdl_engine.CACHE_FILE)
+    server.reset_stats()
+    recorder = PhaseRecorder(server)
+    engine = spdl_engine.UpdateEngine(
+        config=config,
+        token=token,
+        output_dirs=[destination],
+        log=recorder.log,
+        status=recorder.status,
+        progress=recorder.progress,
+        confirm=lambda plans: True,
+        rate_limit=recorder.rate_limit,
+    )
+    recorder.start()
+    result = engine.run()
+    wall = recorder.stop()
+    served = server.snapshot()
+    return {
+        "scenario": name,
+        "ok": result["ok"],
+        "error": result["error"],
+        "missing": result["missing"],
+        "wall_s": round(wall, 4),
+        "throughput_mbps": round(served["bytes_sent"] / 1024 / 1024 / wall, 2) if wall else 0.0,
+        "server": served,
+        "ui_callbacks": recorder.callbacks,
+        "peak_rss_mb": round(max((phase["peak_rss_mb"] for phase in recorder.phases.values()), default=0.0), 1),
+        "phases": recorder.report(),
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<12}{'phase':<10}{'wall s':>9}{'MB':>9}{'MB/s':>9}{'UI calls':>10}{'RSS MB':>9}")
+    for run in results:
+        for phase, entry in run["phases"].items():
+            print(f"{run['scenario']:<12}{phase:<10}{entry['wall_s']:>9.3f}{entry['bytes'] / 1024 / 1024:>9.2f}"
+                  f"{entry['throughput_mbps']:>9.2f}{entry['ui_callbacks']:>10}{entry['peak_rss_mb']:>9.1f}")
+        print(f"{run['scenario']:<12}{'total':<10}{run['wall_s']:>9.3f}{run['server']['bytes_sent'] / 1024 / 1024:>9.2f}"
+              f"{run['throughput_mbps']:>9.2f}{sum(run['ui_callbacks'].values()):>10}{run['peak_rss_mb']:>9.1f}"
+              f"{'' if run['ok'] else '  FAILED'}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the update flow against a local fake GitHub server.")
+    parser.add_argument("--scenarios", default=",".join(DEFAULT_SCENARIOS),
+                        help=f"Comma-separated scenarios to run in order, from {','.join(SCENARIOS)} "
+                             f"(default: {','.join(DEFAULT_SCENARIOS)}).")
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request, in milliseconds.")
+    parser.add_argument("--bandwidth", type=float, default=0, help="Download bandwidth per connection in KB/s (0 = unlimited).")
+    parser.add_argument("--asset-size", type=float, default=1, help="Payload size of each firmware file, in MB.")
+    parser.add_argument("--no-etag", action="store_true", help="Don't send ETags, so revalidation always gets a full response.")
+    parser.add_argument("--fail-rate", type=float, default=0, help="Fraction of downloads answered with HTTP 500.")
+    parser.add_argument("--drop-rate", type=float, default=0, help="Fraction of downloads cut off halfway through.")
+    parser.add_argument("--ignore-if-range", action="store_true",
+                        help="Answer range requests with 206 even when If-Range no longer matches.")
+    parser.add_argument("--replace-asset", default=REPLACED_ASSET,
+                        help=f"OWNER/REPO/NAME of the asset the replaced scenario swaps out (default: {REPLACED_ASSET}).")
+    parser.add_argument("--token", default="", help="Token to send, which enables the GraphQL release lookup.")
+    parser.add_argument("--concurrency", type=int, help="Override max_concurrent_downloads.")
+    parser.add_argument("--segments", type=int, help="Override download_segments.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for injected failures.")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary working directory.")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+
+    repository, _, asset_name = args.replace_asset.rpartition("/")
+    if "replaced" in scenarios and asset_name not in build_assets(0).get(repository, {}):
+        parser.error(f"--replace-asset: no asset {args.replace_asset} on the fake server")
+
+    config = {}
+    if args.concurrency:
+        config["max_concurrent_downloads"] = args.concurrency
+    if args.segments:
+        config["download_segments"] = args.segments
+
+    server = FakeGitHub(build_assets(args.asset_size), latency=args.latency / 1000,
+                        bandwidth=args.bandwidth * 1024, etags=not args.no_etag,
+                        fail_rate=args.fail_rate, drop_rate=args.drop_rate, seed=args.seed,
+                        if_range=not args.ignore_if_range).start()
+    spdl_engine.GITHUB_API_URL = server.url
+    spdl_engine.GITHUB_GRAPHQL_URL = f"{server.url}/graphql"
+
+    original_dir = os.getcwd()
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="spdl-bench-")
+    results = []
+    try:
+        os.chdir(workdir)
+        destination = os.path.join(workdir, "sd")
+        os.makedirs(destination)
+        for name in scenarios:
+            results.append(run_scenario(name, server, config, args.token, destination, args.replace_asset))
+    finally:
+        os.chdir(original_dir)
+        server.stop()
+        if args.keep:
+            print(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    report = {
+        "version": spdl_engine.VERSION,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "keep", "token")},
+        "graphql": bool(args.token),
+        "results": results,
+    }
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return 0 if all(run["ok"] for run in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3472 @@
+#!/usr/bin/env python3
+"""
+3DS Starter Pack engine.
+Fetches, downloads, organizes, verifies and copies the starter pack files without
+any UI, so it can be driven by the GUI, the headless CLI or other Python code.
+
+Usage:
+    python spdl_engine.py --repos Luma3DS,GodMode9 --output-dir /media/sd
+
+This module must never import tkinter or ttkbootstrap.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import random
+import signal
+import threading
+import hashlib
+import queue
+import zlib
+from urllib.parse import urlsplit
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+
+# Filled in by load_heavy_modules() on first use, so importing this module (as the GUI
+# does before its window appears) stays cheap
+requests = zipfile = shutil = None
+
+
+def load_heavy_modules():
+    """Import requests, zipfile and shutil into this module's namespace."""
+    global requests, zipfile, shutil
+    if requests is None:
+        import shutil
+        import zipfile
+        import requests
+
+# --- Script Constants ---
+VERSION = "2.0.0"
+CONFIG_FILE = 'gui_updater_config.json'
+CACHE_FILE = "3ds_starter_pack_cache.json"
+CACHE_DURATION = timedelta(days=1)
+CACHE_SCHEMA_VERSION = 2   # 1 was a flat {owner/repo: entry} dict
+CACHE_LOCK_TIMEOUT = 10.0  # Seconds to wait for another instance to finish writing the cache
+RUN_REPORT_FILE = os.path.join(os.path.dirname(CACHE_FILE), "3ds_starter_pack_runs.jsonl")
+RUN_REPORT_MAX_KB = 1024  # Size at which the run report is rotated to a single .1 backup
+RUN_MANIFEST_FILE = os.path.join(os.path.dirname(CACHE_FILE), "3ds_starter_pack_manifest.json")
+LOCK_FILE = os.path.join(os.path.dirname(CACHE_FILE), "3ds_starter_pack.lock.json")
+# 'update' builds the latest releases and records them in LOCK_FILE; 'pin' rebuilds exactly what LOCK_FILE records
+LOCK_MODE = "update"  # Overridable via 'lock_mode' in the config file
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+# 'auto' resolves stale repositories with one GraphQL query when a PAT is set, 'rest' always uses REST
+METADATA_BACKEND = "auto"  # Overridable via 'metadata_backend' in the config file
+MAX_CONCURRENT_DOWNLOADS = 4  # Overridable via 'max_concurrent_downloads' in the config file
+TOKEN_ENV_VAR = "GITHUB_TOKEN"  # Headless mode reads the GitHub PAT from this environment variable
+
+# --- HTTP client settings ---
+HTTP_CONNECT_TIMEOUT = 10  # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 30     # Seconds to wait between bytes before a socket is considered stalled
+HTTP_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5    # Seconds; doubled on every retry
+HTTP_BACKOFF_MAX = 8.0
+
+# --- GitHub API rate limiting ---
+RATE_LIMIT_MAX_WAIT = 900  # Seconds a run may pause for a rate-limit reset; overridable via 'rate_limit_max_wait'
+RATE_LIMIT_RESERVE = 5     # Below this many remaining requests, stale cached release info is preferred
+SECONDARY_LIMIT_DELAY = 60  # Seconds to back off after a secondary rate limit without Retry-After
+
+# --- Cancellation and time limits ---
+RUN_DEADLINE = 3600  # Seconds a whole run may take before it is aborted (0 = no limit); overridable via 'run_deadline'
+# Seconds each stage may take, counted from its first activity; overridable per stage via 'stage_budgets'
+STAGE_BUDGETS = {"fetch": 300, "download": 1800, "organize": 600, "copy": 1800}
+
+# --- GitHub repositories and desired filename patterns ---
+REPOSITORIES = {
+    "Luma3DS": {
+        "owner": "LumaTeam",
+        "repo": "Luma3DS",
+        "download_filename_patterns": [".zip"],
+    },
+    "GodMode9": {
+        "owner": "d0k3",
+        "repo": "GodMode9",
+        "download_filename_patterns": [".zip"],
+        # Only a few members of the release zip are used, so they can be fetched on their own
+        "selective_extract": True,
+    },
+    "Finalize": {
+        "owner": "hacks-guide",
+        "repo": "finalize",
+        "download_filename_patterns": ["x_finalize_helper.firm", "finalize.romfs"],
+    },
+}
+
+# --- Main output directory and its standard subfolders ---
+DOWNLOAD_DIR = "3DS Starter Pack"
+LUMA_DIR_NAME = "luma"
+PAYLOADS_DIR_NAME = "payloads"
+LUMA_PAYLOADS_FULL_PATH = os.path.join(DOWNLOAD_DIR, LUMA_DIR_NAME, PAYLOADS_DIR_NAME)
+GM9_DIR_FULL_PATH = os.path.join(DOWNLOAD_DIR, "gm9")
+TEMP_DIR = "temp_zip_downloads"
+
+# --- Files that must exist after organizing, grouped by the repository that provides them ---
+CRITICAL_FILES = {
+    "Luma3DS": {"Luma's boot.firm": os.path.join(DOWNLOAD_DIR, "boot.firm")},
+    "GodMode9": {"GodMode9.firm": os.path.join(LUMA_PAYLOADS_FULL_PATH, "GodMode9.firm")},
+    "Finalize": {
+        "x_finalize_helper.firm": os.path.join(LUMA_PAYLOADS_FULL_PATH, "x_finalize_helper.firm"),
+        "finalize.romfs": os.path.join(DOWNLOAD_DIR, "finalize.romfs"),
+    },
+}
+
+# --- Persistent store of downloaded release assets ---
+ASSET_STORE_DIR = "3ds_starter_pack_assets"
+ASSET_STORE_MAX_MB = 512  # Overridable via 'asset_store_max_mb' in the config file
+
+# --- Resumable downloads ---
+PARTIAL_DOWNLOAD_DIR = os.path.join(ASSET_STORE_DIR, "partial")
+PREFETCH_DIR = os.path.join(ASSET_STORE_DIR, "prefetch")  # Assets downloaded ahead of a run wait here for the store
+PARTIAL_DOWNLOAD_MAX_AGE = timedelta(days=7)  # Abandoned .part files older than this are discarded
+DOWNLOAD_SEGMENTS = 1            # Parallel byte-range segments per large asset; overridable via 'download_segments'
+SEGMENTED_DOWNLOAD_MIN_MB = 8    # Assets smaller than this are always fetched as a single stream
+DOWNLOAD_CHUNK_SIZE = 8192
+
+# --- Organizing ---
+EXTRACT_BUFFER_SIZE = 1024 * 1024  # Read size when streaming archive members and files into the staging tree
+
+# --- Remote zip members ---
+REMOTE_ZIP_MEMBERS = True         # Fetch only the needed members of selective archives; overridable via 'remote_zip_members'
+REMOTE_ZIP_TAIL_SIZE = 64 * 1024  # Bytes read from the end of an archive to find its central directory
+REMOTE_ZIP_BLOCK_SIZE = 256 * 1024  # Minimum size of a Range request for bytes that were not prefetched
+REMOTE_ZIP_MAX_FRACTION = 0.75    # If the needed members are more of the archive than this, download it whole
+
+# --- LAN mirror ---
+MIRROR_URL = ""            # Another instance's --serve-mirror address, e.g. http://bench-1:8765; overridable via 'mirror_url'
+MIRROR_PORT = 8765         # Default port for --serve-mirror
+MIRROR_CONNECT_TIMEOUT = 3  # Seconds to reach the mirror before falling back to GitHub
+
+# --- Incremental sync to the output directory ---
+SYNC_MANIFEST_NAME = ".3ds-spdl-manifest.json"  # Written to the destination root
+SYNC_MTIME_TOLERANCE = 2.0  # Seconds; FAT32 SD cards store modification times at 2s resolution
+SYNC_TEMP_SUFFIX = ".spdl-tmp"
+
+# --- Pre-built pack bundles ---
+BUNDLE_DIR = os.path.join(ASSET_STORE_DIR, "bundles")  # Bundles already built, named by release set
+BUNDLE_MANIFEST_NAME = "3ds-spdl-bundle.json"  # First member of every bundle
+BUNDLE_TIMESTAMP = (1980, 1, 1, 0, 0, 0)  # Every member gets this zip timestamp so bundles are reproducible
+BUNDLE_CACHE_KEEP = 3  # Most recently used bundles kept in BUNDLE_DIR
+
+
+class RunMetrics:
+    """Timed spans for one run, exported as JSON lines and summarized per phase.
+
+    Spans nest per thread: annotate() and increment() update the innermost open span
+    of the calling thread, so helpers deep in the call stack (the HTTP client's retry
+    loop, the cache lookup) can attach details without being passed the span.
+    With keep_spans=False finished spans are dropped, for engines that never report them.
+    """
+
+    PHASES = ("setup", "fetch", "download", "organize", "verify", "copy", "finish")
+
+    def __init__(self, keep_spans=True):
+        self.run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.keep_spans = keep_spans
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @contextmanager
+    def span(self, phase, name=None, **attrs):
+        """Time a block of work. Yields the span's attribute dict so callers can add to it."""
+        record = {"phase": phase, "name": name, "bytes": 0, "retries": 0, **attrs}
+        stack = self.local.__dict__.setdefault("stack", [])
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            record["start_s"] = round(start - self.started, 4)
+            record["duration_s"] = round(end - start, 4)
+            if self.keep_spans:
+                with self.lock:
+                    self.spans.append(record)
+
+    def annotate(self, **attrs):
+        stack = getattr(self.local, "stack", None)
+        if stack:
+            stack[-1].update(attrs)
+
+    def increment(self, key, amount=1):
+        stack = getattr(self.local, "stack", None)
+        if stack:
+            stack[-1][key] = stack[-1].get(key, 0) + amount
+
+    def summary(self):
+        """Return per-phase totals: span count, wall time (first start to last end), busy time, bytes, retries."""
+        with self.lock:
+            spans = list(self.spans)
+        phases = {}
+        for record in spans:
+            entry = phases.setdefault(record["phase"], {"spans": 0, "start": record["start_s"], "end": 0.0,
+                                                        "busy_s": 0.0, "bytes": 0, "retries": 0, "cache": {}})
+            entry["spans"] += 1
+            entry["start"] = min(entry["start"], record["start_s"])
+            entry["end"] = max(entry["end"], record["start_s"] + record["duration_s"])
+            entry["busy_s"] += record["duration_s"]
+            entry["bytes"] += record.get("bytes") or 0
+            entry["retries"] += record.get("retries") or 0
+            if record.get("cache"):
+                entry["cache"][record["cache"]] = entry["cache"].get(record["cache"], 0) + 1
+        ordered = sorted(phases, key=lambda phase: (self.PHASES.index(phase) if phase in self.PHASES
+                                                    else len(self.PHASES), phase))
+        return {phase: {"spans": phases[phase]["spans"],
+                        "wall_s": round(phases[phase]["end"] - phases[phase]["start"], 4),
+                        "busy_s": round(phases[phase]["busy_s"], 4),
+                        "bytes": phases[phase]["bytes"],
+                        "retries": phases[phase]["retries"],
+                        "cache": phases[phase]["cache"]}
+                for phase in ordered}
+
+    def summary_lines(self):
+        """Return the per-phase summary as a fixed-width table."""
+        lines = [f"{'Phase':<10}{'Items':>6}{'Wall s':>9}{'Busy s':>9}{'MB':>9}{'MB/s':>8}{'Retries':>9}  Cache"]
+        for phase, entry in self.summary().items():
+            mb = entry["bytes"] / 1024 / 1024
+            rate = mb / entry["wall_s"] if entry["wall_s"] else 0.0
+            cache = ", ".join(f"{status} {count}" for status, count in sorted(entry["cache"].items()))
+            lines.append(f"{phase:<10}{entry['spans']:>6}{entry['wall_s']:>9.2f}{entry['busy_s']:>9.2f}"
+                         f"{mb:>9.2f}{rate:>8.2f}{entry['retries']:>9}  {cache}".rstrip())
+        lines.append(f"{'total':<10}{'':>6}{time.perf_counter() - self.started:>9.2f}")
+        return lines
+
+    def write(self, path, result):
+        """Append this run's spans and a closing 'run' record to a JSON-lines report."""
+        try:
+            if os.path.getsize(path) > RUN_REPORT_MAX_KB * 1024:
+                os.replace(path, f"{path}.1")
+        except OSError:
+            pass
+        with self.lock:
+            spans = list(self.spans)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in sorted(spans, key=lambda record: record["start_s"]):
+                f.write(json.dumps({"type": "span", "run_id": self.run_id, **record}) + "\n")
+            f.write(json.dumps({
+                "type": "run",
+                "run_id": self.run_id,
+                "version": VERSION,
+                "started": self.started_at.isoformat(timespec='seconds'),
+                "duration_s": round(time.perf_counter() - self.started, 4),
+                "ok": result.get("ok"),
+                "missing": result.get("missing"),
+                "error": result.get("error"),
+                "phases": self.summary(),
+            }) + "\n")
+
+
+class RateLimitExceeded(OSError):
+    """The GitHub API budget is exhausted and the reset is further away than we are willing to wait.
+
+    Like requests' own exceptions this is an OSError, so download error handling catches it too.
+    """
+
+
+class RunCancelled(Exception):
+    """The run was cancelled, or ran out of time.
+
+    Unlike RateLimitExceeded this is not an OSError, so the error handling that skips
+    a failed asset and carries on with the others lets it through.
+    """
+
+
+class CancelToken:
+    """Cooperative cancellation for a run, with an overall deadline and per-stage time budgets.
+
+    Long-running loops call check(stage) between blocks of work, which raises
+    RunCancelled once cancel() has been called, the deadline has passed or the stage
+    has used up its budget. A stage's budget is counted from its first check. Sleeps
+    go through wait(), which returns as soon as the run is cancelled, and time spent
+    inside paused() (waiting on the user, say) does not count.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.deadline = None
+        self.budgets = {}
+        self.stage_started = {}
+        self.pauses = {}
+        self.reason = None
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, deadline=0, budgets=None):
+        """Start the clock for a run. A cancel() that came earlier still applies."""
+        self.started = time.monotonic()
+        self.deadline = self.started + deadline if deadline else None
+        self.budgets = {stage: budget for stage, budget in (budgets or {}).items() if budget}
+        self.stage_started = {}
+
+    def cancel(self, reason="Cancelled by user"):
+        with self.lock:
+            if self.reason is None:
+                self.reason = reason
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def check(self, stage=None):
+        """Raise RunCancelled if the run was cancelled or is out of time."""
+        now = time.monotonic()
+        if self.deadline and now >= self.deadline:
+            self.cancel(f"Run exceeded its time limit of {self.deadline - self.started:g}s")
+        elif stage in self.budgets and now >= self._stage_deadline(stage, now):
+            self.cancel(f"The {stage} stage exceeded its time budget of {self.budgets[stage]:g}s")
+        if self.event.is_set():
+            raise RunCancelled(self.reason)
+
+    def _stage_deadline(self, stage, now):
+        return self.stage_started.setdefault(stage, now) + self.budgets[stage]
+
+    def remaining(self, stage=None):
+        """Return the seconds left before the deadline or the stage's budget runs out, or None if unlimited."""
+        now = time.monotonic()
+        limits = [self.deadline] if self.deadline else []
+        if stage in self.budgets:
+            limits.append(self._stage_deadline(stage, now))
+        return max(0.0, min(limits) - now) if limits else None
+
+    def wait(self, delay, stage=None):
+        """Sleep for delay seconds unless the run is cancelled first, then check()."""
+        remaining = self.remaining(stage)
+        self.event.wait(delay if remaining is None else min(delay, remaining))
+        self.check(stage)
+
+    @contextmanager
+    def paused(self, deadline=True):
+        """Stop the stage budgets, and the deadline unless deadline=False, for the duration of the block.
+
+        Overlapping pauses from several threads stop each clock once.
+        """
+        clocks = ("stages", "deadline") if deadline else ("stages",)
+        now = time.monotonic()
+        with self.lock:
+            for clock in clocks:
+                count, since = self.pauses.get(clock, (0, now))
+                self.pauses[clock] = (count + 1, since)
+        try:
+            yield
+        finally:
+            now = time.monotonic()
+            with self.lock:
+                for clock in clocks:
+                    count, since = self.pauses.pop(clock)
+                    if count > 1:
+                        self.pauses[clock] = (count - 1, since)
+                    elif clock == "deadline" and self.deadline:
+                        self.started += now - since
+                        self.deadline += now - since
+                    elif clock == "stages":
+                        for stage in self.stage_started:
+                            self.stage_started[stage] += now - since
+
+
+class RateLimitTracker:
+    """Tracks the GitHub API budget from X-RateLimit-* headers and paces requests around resets.
+
+    Budgets are tracked per resource ('core' for REST, 'graphql' for GraphQL). When a
+    budget is exhausted, requests pause until the reset time, as long as that is within
+    max_wait seconds; otherwise RateLimitExceeded is raised so callers can fall back
+    to cached data.
+    """
+
+    def __init__(self, max_wait=RATE_LIMIT_MAX_WAIT, log=None, on_update=None, cancel_token=None):
+        self.max_wait = max_wait
+        self.log = log or (lambda message: None)
+        self.on_update = on_update
+        self.cancel_token = cancel_token
+        self.budgets = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def applies_to(url):
+        return url.startswith(GITHUB_API_URL)
+
+    @staticmethod
+    def resource_for(url):
+        return "graphql" if url.rstrip("/").endswith("/graphql") else "core"
+
+    def update(self, url, response):
+        """Record the budget reported by a GitHub API response."""
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        try:
+            budget = {
+                "remaining": int(headers["X-RateLimit-Remaining"]),
+                "limit": int(headers.get("X-RateLimit-Limit", 0)),
+                "reset": int(headers.get("X-RateLimit-Reset", 0)),
+            }
+        except ValueError:
+            return
+        resource = headers.get("X-RateLimit-Resource") or self.resource_for(url)
+        with self.lock:
+            self.budgets[resource] = budget
+        if self.on_update:
+            self.on_update(resource, budget["remaining"], budget["limit"], budget["reset"])
+
+    def remaining(self, resource="core"):
+        """Return the last known remaining budget, or None if no response has reported it yet."""
+        with self.lock:
+            budget = self.budgets.get(resource)
+            if budget and budget["reset"] and time.time() >= budget["reset"]:
+                return budget["limit"] or None
+            return budget["remaining"] if budget else None
+
+    def is_low(self, resource="core"):
+        remaining = self.remaining(resource)
+        return remaining is not None and remaining < RATE_LIMIT_RESERVE
+
+    def wait_for_budget(self, url):
+        """Block until the budget for url's resource has reset, if it is exhausted."""
+        resource = self.resource_for(url)
+        with self.lock:
+            budget = self.budgets.get(resource)
+        if not budget or budget["remaining"] > 0:
+            return
+        self.pause(budget["reset"] - time.time() + 1, f"GitHub API rate limit reached ({resource})")
+
+    def retry_delay(self, response):
+        """Return how long to wait before retrying a 403/429 rate-limit response, or None."""
+        if response.status_code not in (403, 429):
+            return None
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        if response.headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                return max(0, int(response.headers.get("X-RateLimit-Reset", 0)) - time.time()) + 1
+            except ValueError:
+                return SECONDARY_LIMIT_DELAY
+        if "secondary rate limit" in response.text.lower():
+            return SECONDARY_LIMIT_DELAY
+        return None
+
+    def pause(self, delay, reason):
+        """Sleep for delay seconds, or raise RateLimitExceeded if that exceeds max_wait or the run's time left."""
+        if delay <= 0:
+            return
+        if delay > self.max_wait:
+            raise RateLimitExceeded(f"{reason}; it resets in {delay / 60:.0f} min, which is longer than "
+                                    f"the {self.max_wait / 60:.0f} min we are allowed to wait")
+        time_left = self.cancel_token.remaining() if self.cancel_token else None
+        if time_left is not None and delay > time_left:
+            raise RateLimitExceeded(f"{reason}; it resets in {delay / 60:.0f} min, after the run's time limit")
+        resume_at = datetime.fromtimestamp(time.time() + delay).strftime('%H:%M:%S')
+        self.log(f"{reason}; pausing until {resume_at} ({delay:.0f}s)...")
+        if self.cancel_token:
+            # max_wait bounds the pause, so it doesn't count against the fetch stage's budget; the deadline still applies
+            with self.cancel_token.paused(deadline=False):
+                self.cancel_token.wait(delay)
+        else:
+            time.sleep(delay)
+
+
+class HttpClient:
+    """A shared keep-alive HTTP session with timeouts, retry/backoff and latency tracking.
+
+    With a cancel_token, no request starts after the run is cancelled, and timeouts
+    and backoffs never outlast its deadline. With keep_latencies=False no latency
+    samples are kept.
+    """
+
+    def __init__(self, pool_size=MAX_CONCURRENT_DOWNLOADS, retries=HTTP_RETRIES, log=None, rate_limiter=None,
+                 metrics=None, cancel_token=None, keep_latencies=True):
+        self.retries = retries
+        self.keep_latencies = keep_latencies
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        self.cancel_token = cancel_token
+        load_heavy_modules()
+        self.RETRYABLE_EXCEPTIONS = (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        )
+        self.timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.log = log or (lambda message: None)
+        self.session = requests.Session()
+        # One pool per host (api.github.com, github.com, objects.githubusercontent.com, ...)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, retries=None, timeout=None):
+        """GET a URL, retrying 5xx responses and connection errors with exponential backoff."""
+        return self.request("GET", url, headers=headers, stream=stream, retries=retries, timeout=timeout)
+
+    def post(self, url, headers=None, json=None, retries=None):
+        """POST a JSON body. Only use this for idempotent requests such as GraphQL queries."""
+        return self.request("POST", url, headers=headers, json=json, retries=retries)
+
+    def request(self, method, url, headers=None, stream=False, json=None, retries=None, timeout=None):
+        """Send a request, retrying 5xx responses and connection errors with exponential backoff."""
+        retries = self.retries if retries is None else retries
+        rate_limiter = self.rate_limiter if self.rate_limiter and self.rate_limiter.applies_to(url) else None
+        for attempt in range(retries + 1):
+            if self.cancel_token:
+                self.cancel_token.check()
+            if rate_limiter:
+                rate_limiter.wait_for_budget(url)
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, stream=stream, json=json,
+                                                timeout=self._timeout(timeout or self.timeout))
+            except self.RETRYABLE_EXCEPTIONS as e:
+                self._record(url, None, start)
+                if attempt >= retries:
+                    raise
+                self._backoff(attempt, retries, url, e)
+                continue
+
+            self._record(url, response.status_code, start)
+            if rate_limiter:
+                rate_limiter.update(url, response)
+                delay = rate_limiter.retry_delay(response)
+                if delay is not None:
+                    response.close()
+                    reason = f"Rate limited by GitHub (HTTP {response.status_code})"
+                    if attempt >= retries:
+                        # Callers fall back to cached data for this, rather than failing on an HTTP error
+                        raise RateLimitExceeded(f"{reason}, still after {retries + 1} attempt(s)")
+                    if self.metrics:
+                        self.metrics.increment("retries")
+                    rate_limiter.pause(delay, reason)
+                    continue
+            if response.status_code >= 500 and attempt < retries:
+                response.close()
+                self._backoff(attempt, retries, url, f"HTTP {response.status_code}")
+                continue
+            return response
+
+    def _timeout(self, timeout):
+        """Shorten a (connect, read) timeout so it cannot outlast the run's deadline."""
+        time_left = self.cancel_token.remaining() if self.cancel_token else None
+        if time_left is None:
+            return timeout
+        time_left = max(time_left, 0.1)
+        if isinstance(timeout, tuple):
+            return tuple(min(part, time_left) for part in timeout)
+        return min(timeout, time_left)
+
+    def sleep(self, delay, stage=None):
+        """Sleep between attempts, waking up early if the run is cancelled."""
+        if self.cancel_token:
+            self.cancel_token.wait(delay, stage)
+        else:
+            time.sleep(delay)
+
+    def backoff_delay(self, attempt):
+        """Return a full-jitter exponential backoff delay for the given attempt."""
+        return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+    def _backoff(self, attempt, retries, url, reason):
+        if self.metrics:
+            self.metrics.increment("retries")
+        delay = self.backoff_delay(attempt)
+        self.log(f"Retrying {url} in {delay:.1f}s (attempt {attempt + 2}/{retries + 1}): {reason}")
+        self.sleep(delay)
+
+    def _record(self, url, status, start):
+        if not self.keep_latencies:
+            return
+        with self.lock:
+            self.latencies.append((url, status, time.monotonic() - start))
+
+    def latency_summary(self):
+        """Return a one-line summary of request count and latency."""
+        with self.lock:
+            samples = [latency for _, _, latency in self.latencies]
+        if not samples:
+            return "HTTP: no requests made."
+        return (f"HTTP: {len(samples)} request(s), avg {sum(samples) / len(samples) * 1000:.0f} ms, "
+                f"max {max(samples) * 1000:.0f} ms.")
+
+    def close(self):
+        self.session.close()
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class AssetStore:
+    """A content-addressed store of downloaded assets with a size cap and LRU eviction.
+
+    Blobs are stored once under objects/<sha256>; index.json maps each asset key
+    (GitHub asset id, or download URL for older cache entries) to its blob. Several
+    processes may share a store (a LAN mirror and a station on one machine), so
+    save() merges this instance's changes into the index on disk under a file lock.
+    """
+
+    def __init__(self, root_dir=ASSET_STORE_DIR, max_bytes=ASSET_STORE_MAX_MB * 1024 * 1024):
+        self.root_dir = root_dir
+        self.objects_dir = os.path.join(root_dir, "objects")
+        self.index_path = os.path.join(root_dir, "index.json")
+        self.lock_path = f"{self.index_path}.lock"
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = self._load_index()
+        self.dirty = set()
+        self.removed = set()
+
+    @staticmethod
+    def asset_key(url, asset_id=None):
+        """Return the store key for an asset, preferring its stable GitHub asset id."""
+        return f"id:{asset_id}" if asset_id else f"url:{url}"
+
+    def _load_index(self):
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            pass
+        return {}
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.objects_dir, sha256)
+
+    def lookup(self, key):
+        """Return the blob path for a key, or None if it is not (or no longer) stored."""
+        with self.lock:
+            entry = self.index.get(key)
+            if not entry:
+                return None
+            path = self._blob_path(entry["sha256"])
+            if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+                self._forget(key)
+                return None
+            entry["last_used"] = time.time()
+            self.dirty.add(key)
+            return path
+
+    def _forget(self, key):
+        self.index.pop(key, None)
+        self.dirty.discard(key)
+        self.removed.add(key)
+
+    def add(self, key, filepath, filename, sha256=None):
+        """Store a copy of a downloaded file under key, hashing it unless sha256 is given."""
+        digest = sha256 or file_sha256(filepath)
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        blob_path = self._blob_path(digest)
+        if not os.path.exists(blob_path):
+            tmp_path = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            shutil.copyfile(filepath, tmp_path)
+            os.replace(tmp_path, blob_path)
+
+        with self.lock:
+            self.index[key] = {
+                "sha256": digest,
+                "size": os.path.getsize(blob_path),
+                "filename": filename,
+                "last_used": time.time(),
+            }
+            self.dirty.add(key)
+            self.removed.discard(key)
+        return digest
+
+    def evict(self):
+        """Remove least-recently-used blobs until the store fits under its size cap."""
+        removed = 0
+        with self.lock:
+            # A blob may be shared by several keys; it is as recent as its most recent key
+            blobs = {}
+            for key, entry in self.index.items():
+                blob = blobs.setdefault(entry["sha256"], {"size": entry["size"], "last_used": 0, "keys": []})
+                blob["last_used"] = max(blob["last_used"], entry["last_used"])
+                blob["keys"].append(key)
+
+            total = sum(blob["size"] for blob in blobs.values())
+            for digest, blob in sorted(blobs.items(), key=lambda item: item[1]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+                for key in blob["keys"]:
+                    self._forget(key)
+                total -= blob["size"]
+                removed += 1
+        return removed
+
+    def save(self):
+        """Merge this instance's changes into the index on disk, evict down to the size cap and write it.
+
+        Returns the number of blobs evicted.
+        """
+        os.makedirs(self.root_dir, exist_ok=True)
+        with FileLock(self.lock_path):
+            on_disk = self._load_index()
+            with self.lock:
+                for key in self.removed:
+                    on_disk.pop(key, None)
+                for key in self.dirty:
+                    entry = self.index[key]
+                    theirs = on_disk.get(key)
+                    if theirs and theirs.get("sha256") == entry["sha256"]:
+                        entry["last_used"] = max(entry["last_used"], theirs.get("last_used", 0))
+                    on_disk[key] = entry
+                self.index = on_disk
+            # Entries other instances added count toward the cap too
+            evicted = self.evict()
+            with self.lock:
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.index, f, indent=4)
+                os.replace(tmp_path, self.index_path)
+                self.dirty.clear()
+                self.removed.clear()
+        return evicted
+
+    def clear(self):
+        """Delete every stored asset."""
+        with self.lock:
+            self.index = {}
+            self.dirty.clear()
+            self.removed.clear()
+            if os.path.exists(self.root_dir):
+                shutil.rmtree(self.root_dir)
+
+
+class DownloadJournal:
+    """Tracks partially downloaded (.part) files so interrupted downloads can resume.
+
+    Each entry is keyed by download URL and records the server's ETag/Last-Modified
+    validators, the total size and, for segmented downloads, the byte ranges. Like
+    the asset store, every save merges into the file on disk under a file lock.
+    """
+
+    def __init__(self, root_dir=PARTIAL_DOWNLOAD_DIR):
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, "journal.json")
+        self.lock_path = f"{self.path}.lock"
+        self.lock = threading.Lock()
+        self.entries = self._load()
+        self.dirty = set()
+        self.removed = set()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            pass
+        return {}
+
+    def _save(self):
+        """Merge this instance's changes into the journal on disk and write it. Call with self.lock held."""
+        os.makedirs(self.root_dir, exist_ok=True)
+        with FileLock(self.lock_path):
+            on_disk = self._load()
+            for url in self.removed:
+                on_disk.pop(url, None)
+            on_disk.update({url: self.entries[url] for url in self.dirty})
+            self.entries = on_disk
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=4)
+            os.replace(tmp_path, self.path)
+            self.dirty.clear()
+            self.removed.clear()
+
+    def _forget(self, url):
+        entry = self.entries.pop(url, None)
+        self.dirty.discard(url)
+        self.removed.add(url)
+        return entry
+
+    def part_path(self, url, filename):
+        """Return the .part path for a download; the URL hash keeps same-named assets apart."""
+        url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.root_dir, f"{url_hash}-{filename}.part")
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+            return dict(entry) if entry else None
+
+    def update(self, url, **fields):
+        """Create or update the journal entry for a URL and persist it."""
+        with self.lock:
+            entry = self.entries.setdefault(url, {})
+            entry.update(fields)
+            entry["updated"] = time.time()
+            self.dirty.add(url)
+            self.removed.discard(url)
+            self._save()
+            return dict(entry)
+
+    def complete(self, url):
+        """Forget a download whose .part file has been moved into place."""
+        with self.lock:
+            if self._forget(url) is not None:
+                self._save()
+
+    def discard(self, url, filename):
+        """Forget a download and delete any partial data for it."""
+        part_path = self.part_path(url, filename)
+        with self.lock:
+            entry = self._forget(url)
+            self._save()
+        segment_count = len(entry.get("segments") or []) if entry else 0
+        for path in [part_path] + [f"{part_path}.{i}" for i in range(segment_count)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def prune(self, max_age=PARTIAL_DOWNLOAD_MAX_AGE):
+        """Discard partial downloads that have not been touched for max_age."""
+        cutoff = time.time() - max_age.total_seconds()
+        stale = [(url, entry.get("filename", "")) for url, entry in self.entries.items()
+                 if entry.get("updated", 0) < cutoff]
+        for url, filename in stale:
+            self.discard(url, filename)
+        return len(stale)
+
+
+class HttpRangeFile:
+    """A read-only, seekable file over HTTP Range requests, so ZipFile can open a remote archive.
+
+    Only the byte ranges that are fetched or read are transferred, and they are kept in
+    memory: this is meant for an archive's central directory and the few members a run needs.
+    """
+
+    def __init__(self, http, url, size, headers=None, block_size=REMOTE_ZIP_BLOCK_SIZE):
+        self.http = http
+        self.url = url
+        self.size = size
+        self.headers = dict(headers or {})
+        self.block_size = block_size
+        self.validator = None
+        self.position = 0
+        self.ranges = []  # (start, bytes) pairs
+        self.bytes_fetched = 0
+        self.requests = 0
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.size, self.position + size)
+        if self.position >= end:
+            return b""
+        data = self._cached(self.position, end)
+        if data is None:
+            self.fetch(self.position, max(end, self.position + self.block_size))
+            data = self._cached(self.position, end)
+        self.position = end
+        return data
+
+    def close(self):
+        self.ranges = []
+
+    def _cached(self, start, end):
+        for range_start, data in self.ranges:
+            if range_start <= start and end <= range_start + len(data):
+                return data[start - range_start:end - range_start]
+        return None
+
+    def fetch(self, start, end):
+        """Download bytes start..end-1 with one Range request, unless they are already held.
+
+        Raises OSError if the server ignores the range or the file changed since the first request.
+        """
+        start, end = max(0, start), min(self.size, end)
+        if start >= end or self._cached(start, end) is not None:
+            return
+        headers = {**self.headers, "Range": f"bytes={start}-{end - 1}"}
+        if self.validator:
+            headers["If-Range"] = self.validator
+        with self.http.get(self.url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise OSError(f"server answered a Range request with HTTP {response.status_code}")
+            content_range = response.headers.get("Content-Range", "")
+            if content_range.rsplit("/", 1)[-1] != str(self.size):
+                raise OSError(f"unexpected Content-Range '{content_range}'")
+            self.validator = self.validator or response.headers.get("ETag") or response.headers.get("Last-Modified")
+            data = b"".join(response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE))
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        if len(data) != end - start:
+            raise OSError(f"expected {end - start} bytes from a Range request, got {len(data)}")
+        self.ranges.append((start, data))
+
+
+class DestinationSync:
+    """Incrementally mirrors the staging tree onto a destination directory.
+
+    A manifest on the destination records the size, mtime and SHA-256 of every file
+    this tool wrote there. A staged file is only copied when the destination copy is
+    missing, differs from the manifest, or has different content. Files are written
+    to a temporary name and renamed into place so a pulled card never holds a
+    half-written file. Other files on the destination are never touched.
+    """
+
+    def __init__(self, source_dir, destination_dir, staged_hashes=None, cancel_token=None):
+        self.source_dir = source_dir
+        self.destination_dir = destination_dir
+        self.cancel_token = cancel_token
+        # {rel_path: {"sha256", "size"}} for staged files already hashed (and verified) this run
+        self.staged_hashes = staged_hashes or {}
+        self.manifest_path = os.path.join(destination_dir, SYNC_MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        try:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f).get("files", {})
+        except (json.JSONDecodeError, IOError, AttributeError):
+            pass
+        return {}
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + SYNC_TEMP_SUFFIX
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "files": self.manifest}, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _staged_files(self):
+        """Yield (rel_path, size) for every file in the staging tree."""
+        for dirpath, _, filenames in os.walk(self.source_dir):
+            for filename in sorted(filenames):
+                source_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(source_path, self.source_dir).replace(os.sep, "/")
+                yield rel_path, os.path.getsize(source_path)
+
+    def _staged_sha256(self, rel_path, size):
+        known = self.staged_hashes.get(rel_path)
+        if known and known["size"] == size:
+            return known["sha256"]
+        return file_sha256(os.path.join(self.source_dir, *rel_path.split("/")))
+
+    def _open_staged(self, rel_path):
+        return open(os.path.join(self.source_dir, *rel_path.split("/")), 'rb')
+
+    def _is_unchanged(self, rel_path, sha256, size):
+        """Decide whether the destination already holds this exact file."""
+        dest_path = os.path.join(self.destination_dir, *rel_path.split("/"))
+        try:
+            dest_stat = os.stat(dest_path)
+        except OSError:
+            return False
+        if dest_stat.st_size != size:
+            return False
+        entry = self.manifest.get(rel_path)
+        if entry and entry.get("sha256") == sha256 and entry.get("size") == size \
+                and abs(entry.get("mtime", 0) - dest_stat.st_mtime) <= SYNC_MTIME_TOLERANCE:
+            return True
+        # Not written by us (or modified since): reading the card is much cheaper than writing it
+        if file_sha256(dest_path) == sha256:
+            self.manifest[rel_path] = {"size": size, "mtime": dest_stat.st_mtime, "sha256": sha256}
+            return True
+        return False
+
+    def plan(self):
+        """Compare the staging tree with the destination and return what needs writing."""
+        plan = {"copy": [], "skip": [], "bytes_to_write": 0, "bytes_skipped": 0}
+        for rel_path, size in self._staged_files():
+            self._check_cancelled()
+            sha256 = self._staged_sha256(rel_path, size)
+            if self._is_unchanged(rel_path, sha256, size):
+                plan["skip"].append((rel_path, size))
+                plan["bytes_skipped"] += size
+            else:
+                dest_exists = os.path.exists(os.path.join(self.destination_dir, *rel_path.split("/")))
+                plan["copy"].append((rel_path, size, sha256, "changed" if dest_exists else "new"))
+                plan["bytes_to_write"] += size
+        return plan
+
+    def _check_cancelled(self):
+        if self.cancel_token:
+            self.cancel_token.check("copy")
+
+    def apply(self, plan, progress=None):
+        """Write every file in the plan with temp-file-plus-rename. Returns bytes written.
+
+        If the run is cancelled, the file being written is removed and the files already
+        written are kept in the manifest.
+        """
+        written = 0
+        try:
+            for rel_path, size, sha256, _ in plan["copy"]:
+                dest_path = os.path.join(self.destination_dir, *rel_path.split("/"))
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                tmp_path = dest_path + SYNC_TEMP_SUFFIX
+                try:
+                    with self._open_staged(rel_path) as src, open(tmp_path, 'wb') as dst:
+                        for block in iter(lambda: src.read(1024 * 1024), b""):
+                            self._check_cancelled()
+                            dst.write(block)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.replace(tmp_path, dest_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                self.manifest[rel_path] = {"size": size, "mtime": os.stat(dest_path).st_mtime, "sha256": sha256}
+                written += size
+                if progress:
+                    progress(rel_path, written, plan["bytes_to_write"])
+        finally:
+            self._save_manifest()
+        return written
+
+    def verify(self, plan):
+        """Re-read the destination and return the files that do not match the staging tree.
+
+        Files written by this sync are read back and hashed; skipped files were already
+        compared while planning and only need their size checked.
+        """
+        mismatched = []
+        for rel_path, size, sha256, _ in plan["copy"]:
+            dest_path = os.path.join(self.destination_dir, *rel_path.split("/"))
+            try:
+                if os.path.getsize(dest_path) != size or file_sha256(dest_path) != sha256:
+                    mismatched.append(rel_path)
+            except OSError:
+                mismatched.append(rel_path)
+        for rel_path, size in plan["skip"]:
+            dest_path = os.path.join(self.destination_dir, *rel_path.split("/"))
+            try:
+                if os.path.getsize(dest_path) != size:
+                    mismatched.append(rel_path)
+            except OSError:
+                mismatched.append(rel_path)
+        return mismatched
+
+
+class BundleSync(DestinationSync):
+    """Syncs the files of a PackBundle onto a destination, reading them straight from the archive."""
+
+    def __init__(self, bundle, destination_dir, cancel_token=None):
+        super().__init__(None, destination_dir, staged_hashes=bundle.files, cancel_token=cancel_token)
+        self.bundle = bundle
+
+    def _staged_files(self):
+        destination_dir = os.path.realpath(self.destination_dir)
+        for rel_path, entry in sorted(self.bundle.files.items()):
+            dest_path = os.path.realpath(os.path.join(destination_dir, *rel_path.split("/")))
+            if os.path.commonpath([destination_dir, dest_path]) != destination_dir:
+                raise OSError(f"{rel_path} in the bundle would be written outside {self.destination_dir}")
+            yield rel_path, entry["size"]
+
+    def _open_staged(self, rel_path):
+        return self.bundle.open_member(rel_path)
+
+
+class FileLock:
+    """An exclusive lock on a sidecar file, shared between processes.
+
+    Uses msvcrt on Windows and flock elsewhere. Acquiring polls until timeout and
+    then raises TimeoutError.
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path, timeout=CACHE_LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self._lock()
+                return self
+            except OSError:
+                if time.monotonic() >= deadline:
+                    self.file.close()
+                    raise TimeoutError(f"Timed out waiting for {self.path}; is another instance running?")
+                time.sleep(self.POLL_INTERVAL)
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._lock(unlock=True)
+        finally:
+            self.file.close()
+
+    def _lock(self, unlock=False):
+        if os.name == 'nt':
+            import msvcrt
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK if unlock else msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN if unlock else fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+class MetadataCache:
+    """Release info cache, kept in memory during a run and written once at the end.
+
+    The file holds {"schema": CACHE_SCHEMA_VERSION, "entries": {owner/repo: entry}}.
+    flush() takes a cross-process lock, merges in entries other instances wrote in
+    the meantime, and replaces the file through a temp file. The previous version is
+    kept as a .bak that load() falls back to if the main file is corrupt, and entries
+    that are individually malformed are dropped instead of the whole cache.
+    """
+
+    def __init__(self, path=CACHE_FILE, log=None):
+        self.path = path
+        self.backup_path = f"{path}.bak"
+        self.lock_path = f"{path}.lock"
+        self.log = log or (lambda message: None)
+        self.entries = {}
+        self.dirty = set()
+        self.read_only = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the cache, recovering from the backup if needed. Returns the entries dict."""
+        for path in (self.path, self.backup_path):
+            try:
+                entries = self._read(path)
+            except FileNotFoundError:
+                continue
+            except (ValueError, OSError) as e:
+                self.log(f"WARNING: Cache file {path} is unreadable ({e}).")
+                continue
+            if path == self.backup_path:
+                self.log(f"Recovered {len(entries)} cached release(s) from {path}.")
+            self.entries = entries
+            return self.entries
+        self.entries = {}
+        return self.entries
+
+    def _read(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("not a JSON object")
+        if "entries" not in data:
+            entries = data  # Schema 1
+        else:
+            entries = data["entries"]
+            if data.get("schema", CACHE_SCHEMA_VERSION) > CACHE_SCHEMA_VERSION and not self.read_only:
+                self.read_only = True
+                self.log(f"WARNING: {path} was written by a newer version; it will not be updated.")
+        if not isinstance(entries, dict):
+            raise ValueError("entries is not a JSON object")
+        return {key: entry for key, entry in entries.items() if isinstance(entry, dict) and "timestamp" in entry}
+
+    def _read_backup(self):
+        try:
+            return self._read(self.backup_path)
+        except (ValueError, OSError):
+            return {}
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.dirty.add(key)
+
+    def flush(self):
+        """Merge this run's changes into the file on disk. Returns True if it was written."""
+        with self.lock:
+            changed = {key: self.entries[key] for key in self.dirty if key in self.entries}
+        if not changed or self.read_only:
+            return False
+        with FileLock(self.lock_path):
+            try:
+                on_disk = self._read(self.path)
+                readable = True
+            except FileNotFoundError:
+                on_disk, readable = {}, False
+            except (ValueError, OSError):
+                # Merge with the backup instead, and don't rotate a corrupt file over it
+                on_disk, readable = self._read_backup(), False
+            if self.read_only:
+                return False
+            merged = {**on_disk, **changed}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"schema": CACHE_SCHEMA_VERSION, "entries": merged}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            if readable:
+                os.replace(self.path, self.backup_path)
+            os.replace(tmp_path, self.path)
+        with self.lock:
+            self.entries.update({key: entry for key, entry in merged.items() if key not in self.dirty})
+            self.dirty.clear()
+        return True
+
+    def clear(self):
+        """Delete the cache and its backup. Returns False if there was nothing to delete."""
+        with FileLock(self.lock_path):
+            existed = False
+            for path in (self.path, self.backup_path):
+                if os.path.exists(path):
+                    os.remove(path)
+                    existed = True
+        with self.lock:
+            self.entries = {}
+            self.dirty.clear()
+        return existed
+
+
+class Lockfile:
+    """The release set a pack was built from, so the same pack can be built again.
+
+    Maps each repository to its release tag and, per asset, the name, download URL,
+    GitHub asset id, SHA-256 and size.
+    """
+
+    def __init__(self, path=LOCK_FILE):
+        self.path = path
+        self.components = {}
+
+    def load(self):
+        """Read the lockfile. Raises OSError if it is missing and ValueError if it is malformed."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        components = data.get("components") if isinstance(data, dict) else None
+        if not isinstance(components, dict):
+            raise ValueError(f"{self.path} has no 'components' section")
+        self.components = components
+        return self
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": VERSION, "components": dict(sorted(self.components.items()))}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def same_release(a, b):
+        """Check whether two components were built from the same assets."""
+        def assets(component):
+            return [(asset.get("url"), str(asset.get("id"))) for asset in component.get("assets", [])]
+        return assets(a) == assets(b)
+
+    @staticmethod
+    def diff(old, new, failed=()):
+        """Compare the components of two builds. Returns {name: {"status", "from", "to"}}.
+
+        status is 'added', 'changed' or 'unchanged' for the components in new, and
+        'failed' for names in failed (resolved but not built).
+        """
+        changes = {}
+        for name, component in new.items():
+            previous = old.get(name)
+            if not previous:
+                status = "added"
+            else:
+                status = "unchanged" if Lockfile.same_release(previous, component) else "changed"
+            changes[name] = {"status": status, "from": previous.get("tag") if previous else None,
+                             "to": component.get("tag")}
+        for name in failed:
+            changes[name] = {"status": "failed", "from": (old.get(name) or {}).get("tag"), "to": None}
+        return changes
+
+
+class PackBundle:
+    """A pre-built pack: the organized staging tree in a single zip.
+
+    BUNDLE_MANIFEST_NAME comes first and records the release set (the components the
+    pack was built from, as in the lockfile) and the SHA-256 and size of every file.
+    The files follow in sorted order with a fixed timestamp and permissions, so the
+    same release set organized by the same version always gives the same bytes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.release_set = None
+        self.components = {}
+        self.files = {}
+        self._zip = None
+
+    @staticmethod
+    def release_set_id(components):
+        """Return the hex SHA-256 identifying a set of components and the version that organized them."""
+        release_set = {name: {"tag": component.get("tag"),
+                              "assets": [[asset.get("name"), asset.get("url"), str(asset.get("id")), asset.get("sha256")]
+                                         for asset in component.get("assets", [])]}
+                       for name, component in components.items()}
+        canonical = json.dumps({"version": VERSION, "components": release_set}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def filename(release_set):
+        return f"3ds_starter_pack-{release_set[:16]}.zip"
+
+    def write(self, source_dir, files, components):
+        """Write the files ({rel_path: {"sha256", "size"}}) under source_dir to the bundle."""
+        self.release_set = self.release_set_id(components)
+        self.components = {name: components[name] for name in sorted(components)}
+        self.files = {rel_path: {"sha256": files[rel_path]["sha256"], "size": files[rel_path]["size"]}
+                      for rel_path in sorted(files)}
+        manifest = json.dumps({"version": VERSION, "release_set": self.release_set, "components": self.components,
+                               "files": self.files}, indent=4, sort_keys=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(self._member_info(BUNDLE_MANIFEST_NAME, len(manifest)), manifest)
+                for rel_path, entry in self.files.items():
+                    source_path = os.path.join(source_dir, *rel_path.split("/"))
+                    with open(source_path, 'rb') as src, zf.open(self._member_info(rel_path, entry["size"]), 'w') as dst:
+                        shutil.copyfileobj(src, dst, EXTRACT_BUFFER_SIZE)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self
+
+    @staticmethod
+    def _member_info(name, size):
+        info = zipfile.ZipInfo(name, date_time=BUNDLE_TIMESTAMP)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.create_system = 3
+        info.external_attr = 0o644 << 16
+        info.file_size = size
+        return info
+
+    def open(self):
+        """Open the bundle and read its manifest. Raises OSError or ValueError if it is not a valid bundle."""
+        try:
+            self._zip = zipfile.ZipFile(self.path, 'r')
+            manifest = json.loads(self._zip.read(BUNDLE_MANIFEST_NAME))
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            self.close()
+            raise ValueError(f"{self.path} is not a 3DS starter pack bundle: {e}")
+        except OSError:
+            self.close()
+            raise
+        files = manifest.get("files") if isinstance(manifest, dict) else None
+        if not isinstance(files, dict) or not manifest.get("release_set"):
+            self.close()
+            raise ValueError(f"{self.path} has a malformed {BUNDLE_MANIFEST_NAME}")
+        for rel_path in files:
+            if not self._is_safe_path(rel_path):
+                self.close()
+                raise ValueError(f"{self.path} contains an unsafe path: {rel_path}")
+        self.release_set = manifest["release_set"]
+        self.components = manifest.get("components", {})
+        self.files = files
+        return self
+
+    @staticmethod
+    def _is_safe_path(rel_path):
+        """Check that a file path stays inside the directory it is unpacked to, on any platform.
+
+        Backslashes count as separators like in _member_path, so '..\\x' is caught on Windows too.
+        """
+        parts = rel_path.replace("\\", "/").split("/")
+        return not any(part in ("", ".", "..") or ":" in part for part in parts)
+
+    def open_member(self, rel_path):
+        return self._zip.open(rel_path)
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+            self._zip = None
+
+
+def load_config(path=CONFIG_FILE):
+    """Load the JSON config file. Returns {} if it does not exist."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def clear_cache():
+    """Delete the release info cache and the asset store. Returns False if there was nothing to clear."""
+    load_heavy_modules()
+    cache_exists = MetadataCache().clear()
+    store_exists = os.path.exists(ASSET_STORE_DIR)
+    if store_exists:
+        AssetStore().clear()
+    return cache_exists or store_exists
+
+
+class UpdateEngine:
+    """Downloads, organizes, verifies and copies the starter pack.
+
+    The engine has no UI of its own. It reports through optional callbacks:
+
+    - log(message), status(text) and progress(percent, text)
+    - confirm(plans) -> bool, asked with {destination_dir: plan} before writing to any destination
+    - error(title, message), for failures the user should be alerted to
+    - rate_limit(resource, remaining, limit, reset), whenever GitHub reports the API budget
+
+    Callbacks are invoked from worker threads.
+    """
+
+    def __init__(self, config=None, token="", output_dirs=(), repositories=None,
+                 log=None, status=None, progress=None, confirm=None, error=None, rate_limit=None):
+        load_heavy_modules()
+        self.config_data = config or {}
+        self.token = token
+        self.output_dirs = list(output_dirs)
+        self.repositories = repositories or REPOSITORIES
+        self.log_message = log or (lambda message: None)
+        self.update_status = status or (lambda text: None)
+        self.update_progress = progress or (lambda value, text="": None)
+        self.confirm = confirm
+        self.on_error = error
+        self.on_rate_limit = rate_limit
+
+        self.metadata_cache = None
+        self.cache_data = {}
+        self.cache_lock = threading.Lock()
+        self.progress_lock = threading.Lock()
+        self.download_progress = {}
+        self.http = None
+        self.asset_store = None
+        self.download_journal = None
+        self.destination_progress = {}
+        self.rate_limiter = None
+        self.metrics = RunMetrics()
+        self.asset_expectations = {}
+        self.manifest_lock = threading.Lock()
+        self.run_manifest = {"assets": {}, "files": {}}
+        self.mirror_url = ""
+        self.lock_mode = LOCK_MODE
+        self.lockfile = None
+        self.previous_build = {}
+        self.components = {}
+        self.carried_files = set()
+        self.bundle = None
+        self.cancel_token = CancelToken()
+
+    def run(self):
+        """Run the whole update. Returns a summary dict with 'ok', 'missing' and 'error'."""
+        result = {"ok": False, "missing": [], "error": None, "destinations": {}, "components": {}, "cancelled": False}
+        self.metrics = RunMetrics()
+        self.asset_expectations = {}
+        self.run_manifest = {"assets": {}, "files": {}}
+        self.components = {}
+        self.carried_files = set()
+        self.cancel_token.start(self._get_run_deadline(), self._get_stage_budgets())
+        try:
+            self.log_message("Starting update process...")
+            self.update_status("Loading cache...")
+            
+            with self.metrics.span("setup"):
+                # Read first: the manifest is rewritten at the end even if setup fails
+                self.previous_build = self._read_run_manifest()
+                self._open_clients()
+                self.mirror_url = self._get_mirror_url()
+                if self.mirror_url:
+                    self.log_message(f"Using LAN mirror {self.mirror_url} (falling back to GitHub).")
+                self.lock_mode = self._get_lock_mode()
+                self.lockfile = self._load_lockfile()
+
+                os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+                os.makedirs(TEMP_DIR, exist_ok=True)
+                self.log_message(f"Created staging directories: '{DOWNLOAD_DIR}/' and '{TEMP_DIR}/'.")
+
+                os.makedirs(LUMA_PAYLOADS_FULL_PATH, exist_ok=True)
+                os.makedirs(GM9_DIR_FULL_PATH, exist_ok=True)
+            verified = self._run_pipeline()
+
+            with self.metrics.span("finish"):
+                # --- Verification and Cleanup ---
+                self.log_message("\n--- Verifying critical files... ---")
+                result["missing"] = self._verify_files(verified)
+                result["components"] = self._finish_components()
+                
+                if os.path.exists(TEMP_DIR):
+                    try:
+                        shutil.rmtree(TEMP_DIR)
+                        self.log_message(f"\nRemoved temporary directory: {TEMP_DIR}")
+                    except Exception as e:
+                        self.log_message(f"ERROR: Could not remove temporary directory {TEMP_DIR}: {e}")
+            
+            # --- Final Copy to Destination ---
+            result["destinations"] = self._copy_to_destinations()
+            self.cancel_token.check()
+
+            self.log_message("\n════════════════════════════════════════════")
+            self.log_message("Update and organization complete!")
+            if not self.output_dirs:
+                self.log_message(f"The '{DOWNLOAD_DIR}' folder is ready.")
+                self.log_message("Copy its contents to the root of your SD card.")
+            self.update_status("Complete!")
+            result["ok"] = not result["missing"] and all(
+                destination["ok"] for destination in result["destinations"].values())
+
+        except RunCancelled as e:
+            self.log_message(f"\nRun aborted: {e}.")
+            self.update_status("Cancelled.")
+            result["error"] = str(e)
+            result["cancelled"] = True
+            self._clean_up_cancelled_run()
+        except Exception as e:
+            self.log_message(f"\nFATAL ERROR: An unexpected error occurred: {e}")
+            self.update_status("Error!")
+            result["error"] = str(e)
+        finally:
+            # Also after a failed or cancelled run, so the assets it did download are found next time
+            if self.asset_store:
+                self._save_asset_store()
+            self._flush_cache()
+            if self.http:
+                self.log_message(self.http.latency_summary())
+                self.http.close()
+            self._write_run_report(result)
+            self._write_run_manifest(result)
+        return result
+
+    def cancel(self, reason="Cancelled by user"):
+        """Ask a running run() or import_bundle() to stop. Safe to call from any thread.
+
+        Every stage notices within a block of work or an HTTP timeout; the run then
+        returns with 'cancelled' set.
+        """
+        self.cancel_token.cancel(reason)
+
+    def _clean_up_cancelled_run(self):
+        """Remove the temporary files of a cancelled run. Partial downloads stay journaled so the next run resumes them."""
+        if os.path.exists(TEMP_DIR):
+            try:
+                shutil.rmtree(TEMP_DIR)
+            except OSError as e:
+                self.log_message(f"ERROR: Could not remove temporary directory {TEMP_DIR}: {e}")
+        if os.path.isdir(PARTIAL_DOWNLOAD_DIR) and any(name.endswith(".part") or ".part." in name
+                                                       for name in os.listdir(PARTIAL_DOWNLOAD_DIR)):
+            self.log_message("Partial downloads were kept; the next run resumes them.")
+
+    def check_for_updates(self, revalidate=True, download=False):
+        """Compare the latest releases with the assets the last run installed.
+
+        With revalidate=False only the metadata cache is read, however old, so the answer
+        is instant. Otherwise stale entries are revalidated first (conditional requests, or
+        the mirror or GraphQL as in a run), leaving the cache fresh for the next run. With
+        download=True, new assets are also downloaded into the asset store, so the run
+        that installs them only has to organize. Returns {repository: [new asset filenames]}
+        for every repository with changes; an empty dict means up to date. A repository
+        with no cached release info counts as changed with no filenames.
+
+        Like run(), a check is bounded by the run deadline and stage budgets, and raises
+        RunCancelled if it runs out of time or cancel() is called.
+        """
+        self.cancel_token.start(self._get_run_deadline(), self._get_stage_budgets())
+        self._open_clients()
+        try:
+            installed = self._installed_asset_urls()
+            if revalidate:
+                self.mirror_url = self._get_mirror_url()
+                releases = self._resolve_releases_graphql()
+                with ThreadPoolExecutor(max_workers=self._get_max_workers(), thread_name_prefix="spdl-check") as executor:
+                    lookups = {name: executor.submit(self._get_latest_release_asset_urls, details["owner"],
+                                                     details["repo"], details["download_filename_patterns"])
+                               for name, details in self.repositories.items() if name not in releases}
+                    releases.update({name: lookup.result() for name, lookup in lookups.items()})
+            else:
+                releases = {}
+                for name, details in self.repositories.items():
+                    entry = self.cache_data.get(f"{details['owner']}/{details['repo']}")
+                    releases[name] = self._cached_assets(entry) if entry else ([], [], [])
+
+            changes = {}
+            for name, (urls, filenames, asset_ids) in releases.items():
+                new = [(url, filename, asset_id) for url, filename, asset_id in zip(urls, filenames, asset_ids)
+                       if url not in installed]
+                if new or not urls:
+                    changes[name] = [filename for _, filename, _ in new]
+                if download:
+                    for url, filename, asset_id in new:
+                        self._prefetch_asset(url, filename, asset_id)
+            return changes
+        finally:
+            self._flush_cache()
+            if download:
+                self._save_asset_store()
+            self.http.close()
+
+    def export_bundle(self, export_dir=None):
+        """Write the pack the last run() built to a bundle and return the bundle's path.
+
+        Bundles are kept in BUNDLE_DIR under the id of their release set; if this release
+        set was bundled before, that bundle is reused instead of written again. With
+        export_dir, the bundle is also copied there.
+        """
+        components = self._built_components()
+        with self.manifest_lock:
+            files = dict(self.run_manifest["files"])
+        if not components or not files:
+            raise ValueError("there is no built pack to export")
+        release_set = PackBundle.release_set_id(components)
+        bundle_path = os.path.join(BUNDLE_DIR, PackBundle.filename(release_set))
+        with self.metrics.span("bundle", os.path.basename(bundle_path)) as span:
+            if self._cached_bundle_matches(bundle_path, release_set):
+                os.utime(bundle_path)
+                span["cached"] = True
+                self.log_message(f"Reusing bundle {bundle_path} for this release set.")
+            else:
+                os.makedirs(BUNDLE_DIR, exist_ok=True)
+                self.update_status("Writing bundle...")
+                PackBundle(bundle_path).write(DOWNLOAD_DIR, files, components)
+                span["bytes"] = os.path.getsize(bundle_path)
+                self.log_message(f"Wrote bundle {bundle_path} ({len(files)} file(s), "
+                                 f"{span['bytes'] / (1024 * 1024):.2f} MB).")
+                self._prune_bundles()
+            if export_dir and os.path.abspath(export_dir) != os.path.abspath(BUNDLE_DIR):
+                export_path = os.path.join(export_dir, os.path.basename(bundle_path))
+                if not self._cached_bundle_matches(export_path, release_set):
+                    tmp_path = f"{export_path}.tmp"
+                    shutil.copyfile(bundle_path, tmp_path)
+                    os.replace(tmp_path, export_path)
+                self.log_message(f"Exported bundle to {export_path}.")
+                bundle_path = export_path
+        self.update_status("Bundle ready.")
+        return bundle_path
+
+    @staticmethod
+    def _cached_bundle_matches(path, release_set):
+        """Check whether path holds a readable bundle of the given release set."""
+        if not os.path.isfile(path):
+            return False
+        bundle = PackBundle(path)
+        try:
+            return bundle.open().release_set == release_set
+        except (OSError, ValueError):
+            return False
+        finally:
+            bundle.close()
+
+    def _prune_bundles(self):
+        """Delete all but the BUNDLE_CACHE_KEEP most recently used bundles in BUNDLE_DIR."""
+        try:
+            bundles = sorted((entry for entry in os.scandir(BUNDLE_DIR) if entry.name.endswith(".zip")),
+                             key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for entry in bundles[BUNDLE_CACHE_KEEP:]:
+                os.remove(entry.path)
+        except OSError as e:
+            self.log_message(f"WARNING: Could not prune old bundles: {e}")
+
+    def import_bundle(self, path):
+        """Sync a bundle written by export_bundle() onto every output directory.
+
+        Nothing is downloaded or organized: files are read straight from the bundle and
+        only the ones a destination does not already hold are written. Returns a summary
+        dict like run(), with the bundle's 'release_set'.
+        """
+        result = {"ok": False, "missing": [], "error": None, "destinations": {}, "components": {},
+                  "cancelled": False, "release_set": None}
+        self.metrics = RunMetrics()
+        self.cancel_token.start(self._get_run_deadline(), self._get_stage_budgets())
+        bundle = PackBundle(path)
+        try:
+            self.log_message(f"Importing bundle {path}...")
+            bundle.open()
+            result["release_set"] = bundle.release_set
+            for name, component in sorted(bundle.components.items()):
+                self.log_message(f"{name}: {component.get('tag') or '?'}")
+            self.log_message(f"Bundle holds {len(bundle.files)} file(s).")
+            self.bundle = bundle
+            result["destinations"] = self._copy_to_destinations()
+            self.cancel_token.check()
+            result["ok"] = bool(result["destinations"]) and all(
+                destination["ok"] for destination in result["destinations"].values())
+            if result["ok"]:
+                self.update_status("Complete!")
+        except RunCancelled as e:
+            self.log_message(f"Import aborted: {e}.")
+            self.update_status("Cancelled.")
+            result["error"] = str(e)
+            result["cancelled"] = True
+        except (OSError, ValueError) as e:
+            self.log_message(f"ERROR: Could not import bundle {path}: {e}")
+            self.update_status("Error!")
+            result["error"] = str(e)
+        finally:
+            self.bundle = None
+            bundle.close()
+            self._write_run_report(result)
+        return result
+
+    def _installed_asset_urls(self):
+        """Return the download URLs of the assets recorded by the last run."""
+        assets = self._read_run_manifest().get("assets", {})
+        return {asset.get("url") for asset in assets.values() if isinstance(asset, dict) and asset.get("url")}
+
+    @staticmethod
+    def _read_run_manifest():
+        """Return the last run's manifest, or {} if there is none."""
+        try:
+            with open(RUN_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _prefetch_asset(self, url, filename, asset_id):
+        """Download a new asset into the asset store ahead of the run that installs it."""
+        store_key = AssetStore.asset_key(url, asset_id)
+        if self.asset_store.lookup(store_key):
+            return
+        os.makedirs(PREFETCH_DIR, exist_ok=True)
+        filepath = self._download_file(url, filename, PREFETCH_DIR, asset_id=asset_id)
+        if filepath:
+            self._add_to_store(store_key, filepath, filename)
+            os.remove(filepath)
+
+    def _open_clients(self, long_lived=False):
+        """Load the metadata cache and create the rate limiter, HTTP client, asset store and download journal.
+
+        A long_lived engine (the LAN mirror's) keeps no spans or request latencies, which
+        would otherwise pile up for as long as it serves.
+        """
+        if long_lived:
+            self.metrics = RunMetrics(keep_spans=False)
+        self.metadata_cache = MetadataCache(log=self.log_message)
+        self.cache_data = self.metadata_cache.load()
+        self.rate_limiter = RateLimitTracker(max_wait=self._get_rate_limit_max_wait(), log=self.log_message,
+                                             on_update=self.on_rate_limit, cancel_token=self.cancel_token)
+        self.http = HttpClient(pool_size=self._get_max_workers() * self._get_download_segments(),
+                               log=self.log_message, rate_limiter=self.rate_limiter, metrics=self.metrics,
+                               cancel_token=self.cancel_token, keep_latencies=not long_lived)
+        self.asset_store = AssetStore(max_bytes=self._get_asset_store_max_bytes())
+        self.download_journal = DownloadJournal()
+        if self.download_journal.prune():
+            self.log_message("Discarded stale partial downloads.")
+
+    def _write_run_manifest(self, result):
+        """Record the hashes of every asset and staged file in the staging tree in RUN_MANIFEST_FILE.
+
+        Components this run did not process (left out with --repos, or not resolved)
+        keep their entries from the last manifest, since their staged files were not touched.
+        """
+        components = self._built_components()
+        with self.manifest_lock:
+            assets = dict(self.run_manifest["assets"])
+            files = dict(self.run_manifest["files"])
+        for name, component in self.previous_build.get("components", {}).items():
+            if name in self.components or name in components:
+                continue
+            filenames = {asset["name"] for asset in component.get("assets", [])}
+            components[name] = component
+            for filename in filenames:
+                if filename in self.previous_build.get("assets", {}):
+                    assets.setdefault(filename, self.previous_build["assets"][filename])
+            for rel_path, entry in self.previous_build.get("files", {}).items():
+                if entry.get("asset") in filenames:
+                    files.setdefault(rel_path, entry)
+        manifest = {
+            "run_id": self.metrics.run_id,
+            "version": VERSION,
+            "assets": assets,
+            "files": files,
+            "components": components,
+            "destinations": result.get("destinations", {}),
+        }
+        try:
+            tmp_path = f"{RUN_MANIFEST_FILE}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, indent=4)
+            os.replace(tmp_path, RUN_MANIFEST_FILE)
+        except OSError as e:
+            self.log_message(f"Error writing run manifest: {e}")
+
+    def _write_run_report(self, result):
+        """Log the per-phase summary table and append the run's spans to RUN_REPORT_FILE."""
+        self.log_message("\n--- Run summary ---")
+        for line in self.metrics.summary_lines():
+            self.log_message(line)
+        try:
+            self.metrics.write(RUN_REPORT_FILE, result)
+            result["report"] = RUN_REPORT_FILE
+        except OSError as e:
+            self.log_message(f"Error writing run report: {e}")
+
+    def _get_max_workers(self):
+        """Return the configured concurrency limit for lookups and downloads."""
+        try:
+            return max(1, int(self.config_data.get('max_concurrent_downloads', MAX_CONCURRENT_DOWNLOADS)))
+        except (TypeError, ValueError):
+            return MAX_CONCURRENT_DOWNLOADS
+
+    def _get_rate_limit_max_wait(self):
+        """Return how many seconds a run may pause waiting for a rate-limit reset."""
+        try:
+            return max(0, float(self.config_data.get('rate_limit_max_wait', RATE_LIMIT_MAX_WAIT)))
+        except (TypeError, ValueError):
+            return RATE_LIMIT_MAX_WAIT
+
+    def _get_download_segments(self):
+        """Return how many parallel byte-range segments to use for large assets."""
+        try:
+            return max(1, int(self.config_data.get('download_segments', DOWNLOAD_SEGMENTS)))
+        except (TypeError, ValueError):
+            return DOWNLOAD_SEGMENTS
+
+    def _get_asset_store_max_bytes(self):
+        """Return the configured asset store size cap in bytes."""
+        try:
+            max_mb = float(self.config_data.get('asset_store_max_mb', ASSET_STORE_MAX_MB))
+        except (TypeError, ValueError):
+            max_mb = ASSET_STORE_MAX_MB
+        return int(max(0, max_mb) * 1024 * 1024)
+
+    def _get_run_deadline(self):
+        """Return how many seconds a run may take in total; 0 means no limit."""
+        try:
+            return max(0, float(self.config_data.get('run_deadline', RUN_DEADLINE)))
+        except (TypeError, ValueError):
+            return RUN_DEADLINE
+
+    def _get_stage_budgets(self):
+        """Return {stage: seconds} from STAGE_BUDGETS and the 'stage_budgets' setting; 0 means no limit."""
+        budgets = dict(STAGE_BUDGETS)
+        configured = self.config_data.get('stage_budgets')
+        for stage, budget in (configured.items() if isinstance(configured, dict) else ()):
+            try:
+                budgets[stage] = max(0, float(budget))
+            except (TypeError, ValueError):
+                pass
+        return budgets
+
+    def _get_lock_mode(self):
+        """Return 'update' or 'pin' from the 'lock_mode' setting."""
+        mode = self.config_data.get('lock_mode', LOCK_MODE)
+        return mode if mode in ("update", "pin") else LOCK_MODE
+
+    def _load_lockfile(self):
+        """Read LOCK_FILE. Pin mode cannot run without it; update mode starts a new one."""
+        lockfile = Lockfile()
+        try:
+            lockfile.load()
+        except (OSError, ValueError) as e:
+            if self.lock_mode == "pin":
+                raise RuntimeError(f"Pin mode needs a readable {LOCK_FILE} ({e}). Run once in update mode to create it.")
+            if not isinstance(e, FileNotFoundError):
+                self.log_message(f"WARNING: Ignoring unreadable {LOCK_FILE}: {e}")
+        return lockfile
+
+    def _get_mirror_url(self):
+        """Return the configured LAN mirror's base URL, or '' to use GitHub directly."""
+        url = self.config_data.get('mirror_url', MIRROR_URL)
+        return url.strip().rstrip("/") if isinstance(url, str) else MIRROR_URL
+
+    def _disable_mirror(self, reason):
+        """Stop using an unreachable mirror for the rest of the run."""
+        if self.mirror_url:
+            self.log_message(f"WARNING: LAN mirror {self.mirror_url} is unreachable ({reason}); using GitHub directly.")
+            self.mirror_url = ""
+
+    def _save_asset_store(self):
+        """Apply the store's size cap and persist its index."""
+        try:
+            evicted = self.asset_store.save()
+            if evicted:
+                self.log_message(f"Evicted {evicted} least recently used asset(s) from the local store.")
+        except OSError as e:
+            self.log_message(f"Error saving asset store: {e}")
+
+    def _run_pipeline(self):
+        """Fetch, download, organize and verify every asset as a staged pipeline.
+
+        Each stage hands finished assets to the next through a bounded queue, so an
+        asset is organized and verified as soon as it lands. Returns the set of
+        critical file labels that were verified along the way.
+        """
+        max_workers = self._get_max_workers()
+        self.log_message(f"Fetching {len(self.repositories)} repositories with up to {max_workers} concurrent requests.")
+        self.update_status("Fetching release info...")
+        with self.progress_lock:
+            self.download_progress = {}
+
+        organize_queue = queue.Queue(maxsize=max_workers)
+        verify_queue = queue.Queue(maxsize=max_workers)
+        verified = set()
+        organizer = threading.Thread(target=self._organize_stage, args=(organize_queue, verify_queue),
+                                     name="spdl-organize", daemon=True)
+        verifier = threading.Thread(target=self._verify_stage, args=(verify_queue, verified),
+                                    name="spdl-verify", daemon=True)
+        organizer.start()
+        verifier.start()
+
+        try:
+            resolved = self._pinned_releases() if self.lock_mode == "pin" else self._resolve_releases_graphql()
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spdl-fetch") as executor:
+                lookups, downloads = {}, {}
+                for name, details in self.repositories.items():
+                    self.log_message(f"\n--- Processing {name} ---")
+                    if name in resolved:
+                        continue
+                    if self.lock_mode == "pin":
+                        self.log_message(f"ERROR: {name} is not in {LOCK_FILE}, so it cannot be pinned.")
+                        continue
+                    future = executor.submit(
+                        self._get_latest_release_asset_urls,
+                        details["owner"], details["repo"], details["download_filename_patterns"]
+                    )
+                    lookups[future] = name
+
+                # Queue each repo's downloads as soon as its lookup resolves, and hand each
+                # download to the organizer as soon as it finishes
+                pending = set(lookups)
+                for name, lookup_result in resolved.items():
+                    pending |= self._queue_repo_downloads(executor, name, lookup_result, downloads, organize_queue)
+                try:
+                    while pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            if future in lookups:
+                                pending |= self._queue_repo_downloads(executor, lookups[future], future.result(),
+                                                                      downloads, organize_queue)
+                            else:
+                                self._finish_download(downloads[future], future.result(), organize_queue)
+                except RunCancelled:
+                    # Downloads that have not started yet are dropped; running ones stop at their next chunk
+                    executor.shutdown(cancel_futures=True)
+                    raise
+        finally:
+            organize_queue.put(None)
+            organizer.join()
+            verifier.join()
+        return verified
+
+    def _queue_repo_downloads(self, executor, name, lookup_result, downloads, organize_queue):
+        """Start downloads for a resolved repository. Returns the new download futures."""
+        details = self.repositories[name]
+        urls, filenames, asset_ids = lookup_result
+        if not (urls and filenames):
+            self.log_message(f"Could not find suitable assets to download for {name}.")
+            self.log_message(f"Manually download from https://github.com/{details['owner']}/{details['repo']}/releases")
+            return set()
+
+        if self.lock_mode != "pin":
+            self.components[name] = self._resolved_component(name, urls, filenames, asset_ids)
+        if self._keep_unchanged_component(name):
+            return set()
+
+        started = set()
+        for url, filename, asset_id in zip(urls, filenames, asset_ids):
+            store_key = AssetStore.asset_key(url, asset_id)
+            stored_path = self._restore_from_store(store_key, filename, url)
+            if stored_path:
+                organize_queue.put((name, filename, stored_path, filename.lower().endswith(".zip"), False))
+                continue
+            self._track_download(filename)
+            download = executor.submit(self._download_file, url, filename, TEMP_DIR, name=name, asset_id=asset_id)
+            downloads[download] = (name, filename, store_key)
+            started.add(download)
+        if started:
+            self.update_status(f"Downloading {len(downloads)} file(s)...")
+        return started
+
+    def _pinned_releases(self):
+        """Resolve every repository from the lockfile instead of GitHub. Returns {name: (urls, filenames, asset_ids)}."""
+        resolved = {}
+        for name in self.repositories:
+            component = self.lockfile.components.get(name)
+            if not component or not component.get("assets"):
+                continue
+            assets = component["assets"]
+            for asset in assets:
+                self.asset_expectations[asset["url"]] = (asset.get("sha256"), asset.get("size"))
+            self.components[name] = component
+            self.log_message(f"Pinned {name} to {component.get('tag') or 'its locked assets'}.")
+            resolved[name] = ([asset["url"] for asset in assets], [asset["name"] for asset in assets],
+                              [asset.get("id") for asset in assets])
+        return resolved
+
+    def _resolved_component(self, name, urls, filenames, asset_ids):
+        """Describe the release resolved for a repository, as the lockfile records it."""
+        details = self.repositories[name]
+        with self.cache_lock:
+            tag = self.cache_data.get(f"{details['owner']}/{details['repo']}", {}).get("tag")
+        assets = []
+        for url, filename, asset_id in zip(urls, filenames, asset_ids):
+            sha256, size = self.asset_expectations.get(url, (None, None))
+            assets.append({"name": filename, "url": url, "id": asset_id, "sha256": sha256, "size": size})
+        return {"tag": tag, "assets": assets}
+
+    def _keep_unchanged_component(self, name):
+        """Keep a component's staged files if the lockfile and the last run's manifest show them built from the same assets.
+
+        The kept files are re-hashed here against the manifest and carried into this
+        run's. Returns False, so the component is rebuilt, if anything differs.
+        """
+        component = self.components.get(name)
+        previous = self.lockfile.components.get(name)
+        if not (component and previous and Lockfile.same_release(previous, component)):
+            return False
+        assets = {asset["name"]: self.previous_build.get("assets", {}).get(asset["name"])
+                  for asset in component["assets"]}
+        files = {rel_path: entry for rel_path, entry in self.previous_build.get("files", {}).items()
+                 if entry.get("asset") in assets}
+        if not (files and all(recorded and recorded.get("url") == asset["url"]
+                              for asset, recorded in zip(component["assets"], assets.values()))):
+            return False
+        for rel_path, entry in files.items():
+            path = os.path.join(DOWNLOAD_DIR, *rel_path.split("/"))
+            try:
+                if os.path.getsize(path) != entry.get("size") or file_sha256(path) != entry.get("sha256"):
+                    return False
+            except OSError:
+                return False
+        with self.manifest_lock:
+            self.run_manifest["assets"].update(assets)
+            self.run_manifest["files"].update(files)
+            self.carried_files.update(files)
+        self.log_message(f"{name} is unchanged since the last build ({component.get('tag') or 'same assets'}); "
+                         f"keeping its {len(files)} staged file(s).")
+        return True
+
+    def _built_components(self):
+        """Return the components whose assets all made it into this run, with their SHA-256s filled in."""
+        built = {}
+        with self.manifest_lock:
+            recorded = dict(self.run_manifest["assets"])
+        for name, component in self.components.items():
+            if not all(asset["name"] in recorded for asset in component["assets"]):
+                continue
+            assets = [{**asset, "sha256": recorded[asset["name"]].get("sha256") or asset.get("sha256")}
+                      for asset in component["assets"]]
+            built[name] = {**component, "assets": assets}
+        return built
+
+    def _finish_components(self):
+        """Log what changed per component since the last build and, in update mode, update the lockfile."""
+        built = self._built_components()
+        failed = [name for name in self.components if name not in built]
+        changes = Lockfile.diff(self.lockfile.components, built, failed)
+        if changes:
+            self.log_message("\n--- Components ---")
+        for name, change in changes.items():
+            if change["status"] == "changed":
+                self.log_message(f"{name}: {change['from'] or '?'} -> {change['to'] or '?'} (changed)")
+            else:
+                self.log_message(f"{name}: {change['to'] or change['from'] or '?'} ({change['status']})")
+        counts = {}
+        for change in changes.values():
+            counts[change["status"]] = counts.get(change["status"], 0) + 1
+        if counts:
+            self.log_message(", ".join(f"{count} {status}" for status, count in counts.items()))
+
+        if self.lock_mode == "update" and built:
+            self.lockfile.components.update(built)
+            try:
+                self.lockfile.save()
+            except OSError as e:
+                self.log_message(f"Error writing {LOCK_FILE}: {e}")
+        return changes
+
+    def _finish_download(self, download, temp_filepath, organize_queue):
+        """Store a completed download and pass it on to the organize stage."""
+        name, filename, store_key = download
+        if isinstance(temp_filepath, HttpRangeFile):
+            # Only part of the archive was fetched, so there is nothing to keep in the store
+            organize_queue.put((name, filename, temp_filepath, True, False))
+        elif temp_filepath:
+            self._add_to_store(store_key, temp_filepath, filename)
+            organize_queue.put((name, filename, temp_filepath, filename.lower().endswith(".zip"), True))
+        else:
+            details = self.repositories[name]
+            self.log_message(f"ERROR: Failed to download {filename} for {name}.")
+            self.log_message(f"Manually download from https://github.com/{details['owner']}/{details['repo']}/releases")
+
+    def _organize_stage(self, organize_queue, verify_queue):
+        """Pipeline stage: organize assets as they arrive, several at a time, then queue them for verification.
+
+        No more assets are taken off organize_queue than there are workers free, so a
+        slow organize stage holds back the downloads feeding it.
+        """
+        max_workers = self._get_max_workers()
+        free_workers = threading.Semaphore(max_workers)
+        futures = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="spdl-extract") as executor:
+                while True:
+                    item = organize_queue.get()
+                    if item is None:
+                        break
+                    free_workers.acquire()
+                    future = executor.submit(self._organize_item, item, verify_queue)
+                    future.add_done_callback(lambda _: free_workers.release())
+                    futures[future] = item[1]
+            for future, original_filename in futures.items():
+                try:
+                    future.result()
+                except RunCancelled:
+                    pass  # The run reports the cancellation itself
+                except Exception as e:
+                    self.log_message(f"ERROR: Failed to organize {original_filename}: {e}")
+        finally:
+            verify_queue.put(None)
+
+    def _organize_item(self, item, verify_queue):
+        """Organize one asset and pass the files it staged on to the verify stage."""
+        name, original_filename, source_path, is_zip_file, consume = item
+        if self.cancel_token.is_cancelled():
+            return
+        self.update_status(f"Organizing {original_filename}...")
+        with self.metrics.span("organize", original_filename) as span:
+            written = self._organize_file(name, original_filename, source_path, is_zip_file, consume)
+            span["files"] = len(written)
+            self._record_staged_files(original_filename, written)
+        verify_queue.put((name, original_filename, list(written)))
+
+    def _verify_stage(self, verify_queue, verified):
+        """Pipeline stage: verify the critical files an asset produced as soon as it is organized."""
+        while True:
+            item = verify_queue.get()
+            if item is None:
+                break
+            name, original_filename, written = item
+            if not written:
+                self.log_message(f"WARNING: {original_filename} did not produce any files.")
+                continue
+            with self.metrics.span("verify", original_filename):
+                self._verify_written(name, original_filename, written, verified)
+
+    def _verify_written(self, name, original_filename, written, verified):
+        """Check the critical files among the paths an asset produced."""
+        written_paths = {os.path.normpath(path) for path in written}
+        for label, path in CRITICAL_FILES.get(name, {}).items():
+            if os.path.normpath(path) not in written_paths:
+                continue
+            try:
+                ok = os.path.getsize(path) > 0
+            except OSError:
+                ok = False
+            if ok:
+                self.log_message(f"Verification: {label} found. OK.")
+                verified.add(label)
+            else:
+                self.log_message(f"WARNING: {label} is missing or empty after organizing {original_filename}!")
+
+    def _restore_from_store(self, store_key, filename, url):
+        """Return the stored blob of an unchanged asset instead of downloading it, or None."""
+        blob_path = self.asset_store.lookup(store_key)
+        if not blob_path:
+            return None
+        # Blobs are named by their SHA-256, so checking GitHub's digest costs no read
+        sha256 = os.path.basename(blob_path)
+        expected_sha256, _ = self.asset_expectations.get(url, (None, None))
+        if expected_sha256 and expected_sha256 != sha256:
+            self.log_message(f"Stored copy of {filename} does not match GitHub's digest; downloading it again.")
+            return None
+        # The organize stage reads the blob in place, so nothing is copied here
+        with self.metrics.span("download", filename, cache="store") as span:
+            self.log_message(f"Using stored copy of {filename} (unchanged release, nothing to download).")
+            span["bytes"] = os.path.getsize(blob_path)
+            self._record_asset(filename, url, sha256, span["bytes"], "store", "sha256" if expected_sha256 else "store")
+        return blob_path
+
+    def _add_to_store(self, store_key, filepath, filename):
+        """Keep a copy of a freshly downloaded asset for future runs."""
+        with self.manifest_lock:
+            sha256 = self.run_manifest["assets"].get(filename, {}).get("sha256")
+        try:
+            self.asset_store.add(store_key, filepath, filename, sha256=sha256)
+        except OSError as e:
+            self.log_message(f"Error adding {filename} to the local store: {e}")
+
+    def _record_asset(self, filename, url, sha256, size, source, checked):
+        """Add an asset to the run manifest. checked says what it was verified against."""
+        with self.manifest_lock:
+            self.run_manifest["assets"][filename] = {"url": url, "sha256": sha256, "size": size, "source": source,
+                                                     "checked": checked}
+
+    def _record_staged_files(self, original_filename, written):
+        """Add the staged files an asset produced ({path: sha256}) to the run manifest."""
+        for path, sha256 in written.items():
+            if not os.path.isfile(path):
+                continue
+            rel_path = os.path.relpath(path, DOWNLOAD_DIR).replace(os.sep, "/")
+            with self.manifest_lock:
+                self.run_manifest["files"][rel_path] = {"sha256": sha256, "size": os.path.getsize(path),
+                                                        "asset": original_filename}
+
+    def _track_download(self, filename):
+        """Register an asset with the overall progress tracker before it starts."""
+        with self.progress_lock:
+            self.download_progress[filename] = [0, 0]
+
+    def _report_download_progress(self, filename, downloaded_size, total_size):
+        """Update per-asset progress and refresh the overall progress bar."""
+        with self.progress_lock:
+            self.download_progress[filename] = [downloaded_size, total_size]
+            overall_done = sum(done for done, _ in self.download_progress.values())
+            overall_total = sum(total for _, total in self.download_progress.values())
+            finished = sum(1 for done, total in self.download_progress.values() if total and done >= total)
+            file_count = len(self.download_progress)
+        if overall_total <= 0:
+            return
+        progress = (overall_done / overall_total) * 100
+        progress_text = (
+            f"{filename} - {downloaded_size/1024/1024:.2f} MB / {total_size/1024/1024:.2f} MB  |  "
+            f"Total: {overall_done/1024/1024:.2f} MB / {overall_total/1024/1024:.2f} MB "
+            f"({finished}/{file_count} files)"
+        )
+        self.update_progress(progress, progress_text)
+
+    def _flush_cache(self):
+        """Write this run's release info changes to the cache file, once per run."""
+        if not self.metadata_cache:
+            return
+        try:
+            if self.metadata_cache.flush():
+                self.log_message(f"Updated cache in {CACHE_FILE}")
+        except OSError as e:
+            self.log_message(f"Error saving cache: {e}")
+
+    def _is_cache_fresh(self, cache_key):
+        """Return True if the cache entry for owner/repo is younger than CACHE_DURATION."""
+        cache_entry = self.cache_data.get(cache_key)
+        if not cache_entry:
+            return False
+        try:
+            cache_time = datetime.fromisoformat(cache_entry["timestamp"])
+        except (KeyError, ValueError):
+            self.log_message(f"Invalid cache timestamp for {cache_key}, fetching new data")
+            return False
+        return datetime.utcnow() - cache_time < CACHE_DURATION
+
+    def _get_latest_release_asset_urls(self, owner, repo, patterns, retry_count=3):
+        """Fetches all matching assets from the latest release, using cache if available."""
+        with self.metrics.span("fetch", f"{owner}/{repo}", cache="miss"):
+            return self._fetch_release_asset_urls(owner, repo, patterns, retry_count)
+
+    def _fetch_release_asset_urls(self, owner, repo, patterns, retry_count):
+        """Resolve a release from the cache or the REST API, noting which in the current span."""
+        self.cancel_token.check("fetch")
+        cache_key = f"{owner}/{repo}"
+        if self._is_cache_fresh(cache_key):
+            self.log_message(f"Using cached data for {owner}/{repo}")
+            self.metrics.annotate(cache="hit")
+            return self._cached_assets(self.cache_data[cache_key])
+        if cache_key in self.cache_data and self.rate_limiter.is_low():
+            # Save what is left of the budget for repositories we know nothing about
+            self.log_message(f"GitHub API budget is low ({self.rate_limiter.remaining()} left), "
+                             f"using older cached data for {owner}/{repo}")
+            self.metrics.annotate(cache="stale")
+            return self._cached_assets(self.cache_data[cache_key])
+        if self.mirror_url:
+            mirrored = self._fetch_release_from_mirror(owner, repo, patterns)
+            if mirrored:
+                return mirrored
+
+        api_url = f"{GITHUB_API_URL}/repos/{owner}/{repo}/releases/latest"
+        headers = {"Accept": "application/vnd.github.com.v3+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if cache_key in self.cache_data and "etag" in self.cache_data[cache_key]:
+            headers["If-None-Match"] = self.cache_data[cache_key]["etag"]
+        
+        try:
+            response = self.http.get(api_url, headers=headers, retries=retry_count)
+            if response.status_code == 304:
+                self.log_message(f"No changes for {owner}/{repo} (ETag match), using cached data.")
+                self.metrics.annotate(cache="304")
+                return self._revalidated(cache_key)
+
+            response.raise_for_status()
+            self.metrics.annotate(bytes=len(response.content))
+            release_data = response.json()
+            assets = release_data.get("assets", [])
+            return self._select_assets(owner, repo, assets, patterns, etag=response.headers.get("ETag", ""),
+                                       tag=release_data.get("tag_name"))
+
+        except RateLimitExceeded as e:
+            if cache_key in self.cache_data:
+                self.log_message(f"{e}. Using older cached data for {owner}/{repo}.")
+                self.metrics.annotate(cache="stale")
+                return self._cached_assets(self.cache_data[cache_key])
+            self.log_message(f"ERROR fetching release for {owner}/{repo}: {e}")
+            self.metrics.annotate(error=str(e))
+            return [], [], []
+        except requests.exceptions.RequestException as e:
+            self.log_message(f"ERROR fetching release for {owner}/{repo}: {e}")
+            self.metrics.annotate(error=str(e))
+            return [], [], []
+
+    def _revalidated(self, cache_key):
+        """Mark a cache entry the server confirmed unchanged as fresh again, and return its assets."""
+        with self.cache_lock:
+            entry = {**self.cache_data[cache_key], "timestamp": datetime.utcnow().isoformat()}
+            self.metadata_cache.put(cache_key, entry)
+        return self._cached_assets(entry)
+
+    def _fetch_release_from_mirror(self, owner, repo, patterns):
+        """Resolve a release through the LAN mirror. Returns None to fall back to GitHub."""
+        cache_key = f"{owner}/{repo}"
+        headers = {"Accept": "application/json"}
+        if cache_key in self.cache_data and self.cache_data[cache_key].get("etag"):
+            headers["If-None-Match"] = self.cache_data[cache_key]["etag"]
+        try:
+            response = self.http.get(f"{self.mirror_url}/repos/{owner}/{repo}/releases/latest", headers=headers,
+                                     retries=0, timeout=(MIRROR_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+            if response.status_code == 304 and cache_key in self.cache_data:
+                self.log_message(f"No changes for {owner}/{repo} on the mirror, using cached data.")
+                self.metrics.annotate(cache="304")
+                return self._revalidated(cache_key)
+            if response.status_code != 200:
+                self.log_message(f"Mirror has no release info for {owner}/{repo} (HTTP {response.status_code}); asking GitHub.")
+                return None
+            release_data = response.json()
+        except requests.exceptions.RequestException as e:
+            self._disable_mirror(e)
+            return None
+        except ValueError as e:
+            self.log_message(f"Mirror sent unreadable release info for {owner}/{repo} ({e}); asking GitHub.")
+            return None
+        self.log_message(f"Fetched release info for {owner}/{repo} from the mirror.")
+        self.metrics.annotate(cache="mirror", bytes=len(response.content))
+        return self._select_assets(owner, repo, release_data.get("assets", []), patterns,
+                                   etag=response.headers.get("ETag", ""), tag=release_data.get("tag_name"))
+
+    def _select_assets(self, owner, repo, assets, patterns, etag=None, tag=None):
+        """Pick the assets matching patterns from a release's asset list and cache them.
+
+        assets use the REST API's field names. etag=None keeps the cached ETag if the
+        asset list is unchanged (the GraphQL API has no ETags). tag is the release's tag name.
+        """
+        cache_key = f"{owner}/{repo}"
+        urls, filenames, asset_ids, digests, sizes = [], [], [], [], []
+        for pattern in patterns:
+            for asset in assets:
+                if asset["name"].lower().endswith(pattern.lower()):
+                    self.log_message(f"Found asset for {owner}/{repo}: {asset['name']}")
+                    urls.append(asset["browser_download_url"])
+                    filenames.append(asset["name"])
+                    asset_ids.append(asset.get("id"))
+                    digests.append(asset.get("digest"))
+                    sizes.append(asset.get("size"))
+
+        if not urls:
+            self.log_message(f"No asset found matching patterns {patterns} for {owner}/{repo}.")
+            return [], [], []
+
+        with self.cache_lock:
+            previous = self.cache_data.get(cache_key, {})
+            if etag is None:
+                etag = previous.get("etag", "") if previous.get("urls") == urls else ""
+            entry = {
+                "urls": urls,
+                "filenames": filenames,
+                "asset_ids": asset_ids,
+                "digests": digests,
+                "sizes": sizes,
+                "tag": tag,
+                "timestamp": datetime.utcnow().isoformat(),
+                "etag": etag
+            }
+            self.metadata_cache.put(cache_key, entry)
+        return self._cached_assets(entry)
+
+    def _resolve_releases_graphql(self):
+        """Resolve every repository with a stale cache entry in a single GraphQL query.
+
+        GraphQL needs a PAT, so this only runs when one is set and 'metadata_backend' is
+        not 'rest'. In 'auto' mode it is skipped for a single stale repository, where a
+        conditional REST request is just as cheap. Returns {name: (urls, filenames,
+        asset_ids)} for the repositories it resolved; the rest fall back to REST.
+        """
+        backend = self.config_data.get('metadata_backend', METADATA_BACKEND)
+        if backend == 'rest' or not self.token or self.mirror_url:
+            return {}
+        stale = [(name, details) for name, details in self.repositories.items()
+                 if not self._is_cache_fresh(f"{details['owner']}/{details['repo']}")]
+        if not stale or (backend == 'auto' and len(stale) < 2) or self.rate_limiter.is_low("graphql"):
+            return {}
+
+        variables, fields, params = {}, [], []
+        for index, (_, details) in enumerate(stale):
+            variables[f"owner{index}"] = details["owner"]
+            variables[f"name{index}"] = details["repo"]
+            params.append(f"$owner{index}: String!, $name{index}: String!")
+            fields.append(
+                f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{ "
+                "latestRelease { tagName releaseAssets(first: 100) { nodes { databaseId name downloadUrl size digest } } } }")
+        query = f"query({', '.join(params)}) {{ {' '.join(fields)} }}"
+        headers = {"Authorization": f"Bearer {self.token}"}
+
+        try:
+            with self.metrics.span("fetch", "graphql", cache="graphql", repositories=len(stale)) as span:
+                response = self.http.post(GITHUB_GRAPHQL_URL, headers=headers, json={"query": query, "variables": variables})
+                span["bytes"] = len(response.content)
+                response.raise_for_status()
+                payload = response.json()
+        except (requests.exceptions.RequestException, RateLimitExceeded, ValueError) as e:
+            self.log_message(f"GraphQL release lookup failed ({e}), falling back to the REST API.")
+            return {}
+        if payload.get("errors"):
+            self.log_message(f"GraphQL reported {len(payload['errors'])} error(s); affected repositories will use the REST API.")
+
+        data = payload.get("data") or {}
+        resolved = {}
+        for index, (name, details) in enumerate(stale):
+            release = (data.get(f"r{index}") or {}).get("latestRelease")
+            if not release:
+                continue
+            # databaseId is the numeric id the REST API returns, so both backends key the store alike
+            assets = [
+                {"name": node["name"], "browser_download_url": node["downloadUrl"], "id": node.get("databaseId"),
+                 "size": node.get("size"), "digest": node.get("digest")}
+                for node in (release.get("releaseAssets") or {}).get("nodes") or []
+            ]
+            result = self._select_assets(details["owner"], details["repo"], assets, details["download_filename_patterns"],
+                                         tag=release.get("tagName"))
+            if result[0]:
+                resolved[name] = result
+        self.log_message(f"Resolved {len(resolved)} of {len(stale)} repositories with one GraphQL request.")
+        return resolved
+
+    def _cached_assets(self, cache_entry):
+        """Return (urls, filenames, asset_ids) from a cache entry, noting each asset's expected digest and size."""
+        urls = cache_entry.get("urls", [])
+        # Entries written before asset ids were cached, or with GraphQL node ids, fall back to URL keys
+        asset_ids = [asset_id if isinstance(asset_id, int) else None
+                     for asset_id in cache_entry.get("asset_ids") or [None] * len(urls)]
+        digests = cache_entry.get("digests") or [None] * len(urls)
+        sizes = cache_entry.get("sizes") or [None] * len(urls)
+        for url, digest, size in zip(urls, digests, sizes):
+            expected_sha256 = digest[len("sha256:"):] if digest and digest.startswith("sha256:") else None
+            self.asset_expectations[url] = (expected_sha256, size)
+        return urls, cache_entry.get("filenames", []), asset_ids
+
+    def _download_headers(self, source_url=None):
+        headers = {"Accept": "application/octet-stream"}
+        # The PAT is only ever sent to GitHub, never to a mirror
+        if self.token and not source_url:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+    def _download_file(self, url, filename, download_path, retry_count=HTTP_RETRIES, name=None, asset_id=None):
+        """Downloads a file, resuming any partial copy left by an earlier attempt.
+
+        For a selective archive of repository name, only the members organizing needs are
+        fetched when the server allows it; an HttpRangeFile holding them is returned instead of a path.
+        With a LAN mirror configured, assets with a GitHub asset id are fetched from the
+        mirror first and from GitHub only if that fails.
+        """
+        with self.metrics.span("download", filename, cache="network") as span:
+            sources = [f"{self.mirror_url}/assets/{asset_id}", None] \
+                if self.mirror_url and asset_id else [None]
+            for source_url in sources:
+                if source_url is None and len(sources) > 1:
+                    self.log_message(f"Mirror could not provide {filename}; downloading it from GitHub.")
+                if name and self._wants_remote_members(name, filename):
+                    remote = self._fetch_zip_members(name, url, filename, source_url)
+                    if remote:
+                        span["cache"] = "range"
+                        span["bytes"] = remote.bytes_fetched
+                        span["requests"] = remote.requests
+                        return remote
+                filepath = self._fetch_asset(url, filename, download_path, retry_count, source_url)
+                if filepath:
+                    span["cache"] = "mirror" if source_url else "network"
+                    break
+            span["bytes"] = os.path.getsize(filepath) if filepath else 0
+            if not filepath:
+                span["error"] = "download failed"
+        return filepath
+
+    def _fetch_asset(self, url, filename, download_path, retry_count, source_url=None):
+        """Download an asset into download_path. Returns its path, or None on failure.
+
+        source_url is where to fetch it from if not url itself (a LAN mirror); the journal
+        and integrity checks are still keyed by url.
+        """
+        self.log_message(f"Downloading {filename}{' from the mirror' if source_url else ''}...")
+        headers = self._download_headers(source_url)
+        part_path = self.download_journal.part_path(url, filename)
+        os.makedirs(os.path.dirname(part_path), exist_ok=True)
+
+        try:
+            # A journaled download resumes in whichever mode it was started in
+            entry = self.download_journal.get(url)
+            use_segments = bool(entry.get("segments")) if entry else self._get_download_segments() > 1
+            sha256 = None
+            if use_segments:
+                sha256 = self._download_segmented(url, filename, headers, part_path, retry_count, source_url)
+            if not sha256:
+                sha256 = self._download_resumable(url, filename, headers, part_path, retry_count, source_url)
+
+            size = os.path.getsize(part_path)
+            checked, problem = self._check_integrity(url, sha256, size)
+            if problem:
+                # Never let bad bytes reach the staging folder, or resume from them next time
+                self.download_journal.discard(url, filename)
+                self.log_message(f"ERROR: {filename} failed its integrity check ({problem}) and was discarded.")
+                self.metrics.annotate(error="integrity check failed")
+                return None
+            self._record_asset(filename, url, sha256, size, "mirror" if source_url else "network", checked)
+
+            filepath = os.path.join(download_path, filename)
+            shutil.move(part_path, filepath)
+            self.download_journal.complete(url)
+            self.log_message(f"Successfully downloaded {filename}")
+            return filepath
+        except (requests.exceptions.RequestException, OSError) as e:
+            self.log_message(f"Error downloading {filename}: {e}")
+            if os.path.exists(part_path) and self.download_journal.get(url):
+                self.log_message(f"Kept {os.path.getsize(part_path)/1024/1024:.2f} MB of {filename}; the next attempt will resume it.")
+            return None
+
+    def _wants_remote_members(self, name, filename):
+        """Check whether an asset should be read member by member instead of downloaded whole."""
+        if not (filename.lower().endswith(".zip") and self.repositories[name].get("selective_extract")):
+            return False
+        enabled = self.config_data.get('remote_zip_members', REMOTE_ZIP_MEMBERS)
+        return enabled if isinstance(enabled, bool) else REMOTE_ZIP_MEMBERS
+
+    def _fetch_zip_members(self, name, url, filename, source_url=None):
+        """Fetch only the members of a release zip that organizing will use, with Range requests.
+
+        The end of central directory record and the central directory come from the tail
+        of the archive, then each needed member's byte range (local header, data and any
+        data descriptor, up to the next member) is fetched, merging neighbouring ranges.
+        Members already staged with the same CRC32 and size are not fetched at all.
+        Returns the HttpRangeFile, or None to fall back to a full download.
+        """
+        _, size = self.asset_expectations.get(url, (None, None))
+        if not size:
+            return None
+        remote = HttpRangeFile(self.http, source_url or url, size, headers=self._download_headers(source_url))
+        try:
+            remote.fetch(size - REMOTE_ZIP_TAIL_SIZE, size)
+            with zipfile.ZipFile(remote) as zf:
+                offsets = sorted({info.header_offset for info in zf.infolist()} | {zf.start_dir})
+                member_end = dict(zip(offsets, offsets[1:]))
+                spans = sorted((info.header_offset, member_end[info.header_offset])
+                               for info, target in self._archive_targets(name, zf)
+                               if not self._staged_checksum(info, target))
+            needed = sum(end - start for start, end in spans)
+            if needed > size * REMOTE_ZIP_MAX_FRACTION:
+                self.log_message(f"{filename}: the needed files are most of the archive; downloading it whole.")
+                return None
+            merged = []
+            for start, end in spans:
+                if merged and start - merged[-1][1] < REMOTE_ZIP_BLOCK_SIZE:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            for start, end in merged:
+                remote.fetch(start, end)
+        except (requests.exceptions.RequestException, OSError, zipfile.BadZipFile) as e:
+            self.log_message(f"Could not read {filename} remotely ({e}); downloading the whole archive.")
+            return None
+
+        self._report_download_progress(filename, remote.bytes_fetched, remote.bytes_fetched)
+        # ZipFile checks each member's CRC32 as it is extracted; the archive as a whole is never seen
+        self._record_asset(filename, url, None, size, "remote", "crc32")
+        self.log_message(f"Fetched {len(spans)} needed file(s) of {filename} with {remote.requests} range "
+                         f"request(s): {remote.bytes_fetched/1024/1024:.2f} MB of {size/1024/1024:.2f} MB.")
+        return remote
+
+    def _check_integrity(self, url, sha256, size):
+        """Compare a download with GitHub's digest and size. Returns (checked, problem)."""
+        expected_sha256, expected_size = self.asset_expectations.get(url, (None, None))
+        if expected_size and size != expected_size:
+            return "size", f"expected {expected_size} bytes, got {size}"
+        if expected_sha256:
+            if sha256 != expected_sha256:
+                return "sha256", f"expected SHA-256 {expected_sha256}, got {sha256}"
+            return "sha256", None
+        return ("size" if expected_size else "none"), None
+
+    def _download_resumable(self, url, filename, headers, part_path, retry_count, source_url=None):
+        """Stream a URL into part_path, resuming with a Range request when the journal allows it.
+
+        Returns the file's SHA-256, computed as the bytes arrive.
+        """
+        for attempt in range(retry_count + 1):
+            entry = self.download_journal.get(url)
+            offset = os.path.getsize(part_path) if entry and os.path.exists(part_path) else 0
+            request_headers = dict(headers)
+            if offset:
+                request_headers["Range"] = f"bytes={offset}-"
+                validator = entry.get("etag") or entry.get("last_modified")
+                if validator:
+                    # The server only honours the range if the file is unchanged
+                    request_headers["If-Range"] = validator
+
+            # Connection failures and 5xx responses are retried inside the client
+            response = self.http.get(source_url or url, headers=request_headers, stream=True, retries=retry_count)
+            if response.status_code == 416:
+                response.close()
+                self.download_journal.discard(url, filename)
+                continue
+            response.raise_for_status()
+
+            etag = response.headers.get("ETag", "")
+            last_modified = response.headers.get("Last-Modified", "")
+            if offset and response.status_code == 206 and not (
+                    self._validators_match(entry, etag, last_modified)
+                    and response.headers.get("Content-Range", "").startswith(f"bytes {offset}-")):
+                # A server that ignores If-Range sends part of the new file; it cannot be appended to the old one
+                response.close()
+                self.log_message(f"{filename} changed on the server since it was partly downloaded; starting over.")
+                self.download_journal.discard(url, filename)
+                continue
+            content_length = int(response.headers.get('content-length', 0))
+            if offset and response.status_code == 206:
+                self.log_message(f"Resuming {filename} from {offset/1024/1024:.2f} MB")
+                self.metrics.annotate(resumed_from=offset)
+                mode, downloaded_size = 'ab', offset
+            else:
+                mode, downloaded_size = 'wb', 0
+            total_size = downloaded_size + content_length if content_length else 0
+            self.download_journal.update(url, filename=filename, etag=etag, last_modified=last_modified,
+                                         total_size=total_size, segments=None)
+            sha256 = hashlib.sha256()
+            if mode == 'ab':
+                # Only the part kept from an earlier attempt needs reading back
+                with open(part_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b""):
+                        sha256.update(block)
+
+            try:
+                with response, open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        self.cancel_token.check("download")
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        downloaded_size += len(chunk)
+                        if total_size > 0:
+                            self._report_download_progress(filename, downloaded_size, total_size)
+                if total_size and downloaded_size < total_size:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Connection closed after {downloaded_size} of {total_size} bytes")
+                return sha256.hexdigest()
+            except self.http.RETRYABLE_EXCEPTIONS as e:
+                # The connection dropped mid-stream; keep the .part file and resume from it
+                if attempt >= retry_count:
+                    raise
+                delay = self.http.backoff_delay(attempt)
+                self.metrics.increment("retries")
+                self.log_message(f"Download of {filename} interrupted ({e}), resuming in {delay:.1f}s...")
+                self.http.sleep(delay, "download")
+        raise requests.exceptions.RequestException(f"Could not resume {filename}; giving up after {retry_count + 1} attempts")
+
+    def _download_segmented(self, url, filename, headers, part_path, retry_count, source_url=None):
+        """Download a large asset as parallel byte-range segments.
+
+        Returns the file's SHA-256, computed while the segments are joined, or False
+        when the server does not support ranges, the asset is too small to split, or
+        it changed since the segments were journaled.
+        """
+        entry = self.download_journal.get(url)
+        if not (entry and entry.get("segments")):
+            with self.http.get(source_url or url, headers={**headers, "Range": "bytes=0-0"}, stream=True,
+                               retries=retry_count) as probe:
+                probe.raise_for_status()
+                content_range = probe.headers.get("Content-Range", "")
+                if probe.status_code != 206 or not content_range.rsplit("/", 1)[-1].isdigit():
+                    return False
+                total_size = int(content_range.rsplit("/", 1)[-1])
+                etag = probe.headers.get("ETag", "")
+                last_modified = probe.headers.get("Last-Modified", "")
+            if total_size < SEGMENTED_DOWNLOAD_MIN_MB * 1024 * 1024:
+                return False
+            segment_count = self._get_download_segments()
+            segment_size = -(-total_size // segment_count)
+            segments = [[start, min(start + segment_size, total_size) - 1]
+                        for start in range(0, total_size, segment_size)]
+            entry = self.download_journal.update(url, filename=filename, etag=etag, last_modified=last_modified,
+                                                 total_size=total_size, segments=segments)
+
+        segments = entry["segments"]
+        total_size = entry["total_size"]
+        validator = entry.get("etag") or entry.get("last_modified")
+        progress = [0] * len(segments)
+        progress_lock = threading.Lock()
+
+        def report(index, done):
+            with progress_lock:
+                progress[index] = done
+                downloaded_size = sum(progress)
+            self._report_download_progress(filename, downloaded_size, total_size)
+
+        self.log_message(f"Downloading {filename} in {len(segments)} parallel segments.")
+        self.metrics.annotate(segments=len(segments))
+        with ThreadPoolExecutor(max_workers=len(segments), thread_name_prefix="spdl-segment") as executor:
+            futures = [
+                executor.submit(self._download_segment, source_url or url, headers, f"{part_path}.{index}", start, end,
+                                validator, retry_count, lambda done, index=index: report(index, done))
+                for index, (start, end) in enumerate(segments)
+            ]
+            try:
+                results = [future.result() for future in futures]
+            except RunCancelled:
+                executor.shutdown(cancel_futures=True)
+                raise
+
+        if not all(results):
+            self.log_message(f"{filename} changed on the server; restarting the download.")
+            self.download_journal.discard(url, filename)
+            return False
+
+        sha256 = hashlib.sha256()
+        with open(part_path, 'wb') as out:
+            for index in range(len(segments)):
+                with open(f"{part_path}.{index}", 'rb') as segment_file:
+                    for block in iter(lambda: segment_file.read(1024 * 1024), b""):
+                        out.write(block)
+                        sha256.update(block)
+        for index in range(len(segments)):
+            os.remove(f"{part_path}.{index}")
+        return sha256.hexdigest()
+
+    def _download_segment(self, url, headers, segment_path, start, end, validator, retry_count, report):
+        """Download bytes start..end (inclusive) into segment_path, resuming what is already there."""
+        for attempt in range(retry_count + 1):
+            have = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+            report(have)
+            if start + have > end:
+                return True
+            request_headers = {**headers, "Range": f"bytes={start + have}-{end}"}
+            if validator:
+                request_headers["If-Range"] = validator
+            response = self.http.get(url, headers=request_headers, stream=True, retries=retry_count)
+            response.raise_for_status()
+            if response.status_code != 206:
+                # The validator no longer matches: the asset was replaced
+                response.close()
+                return False
+            try:
+                with response, open(segment_path, 'ab') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        self.cancel_token.check("download")
+                        f.write(chunk)
+                        have += len(chunk)
+                        report(have)
+                if start + have > end:
+                    return True
+                raise requests.exceptions.ChunkedEncodingError(f"Segment closed early at byte {start + have}")
+            except self.http.RETRYABLE_EXCEPTIONS:
+                if attempt >= retry_count:
+                    raise
+                self.http.sleep(self.http.backoff_delay(attempt), "download")
+        raise requests.exceptions.RequestException(f"Segment {start}-{end} failed after {retry_count + 1} attempts")
+
+    @staticmethod
+    def _validators_match(entry, etag, last_modified):
+        """Check a 206 response against the validators recorded when the .part file was started."""
+        if entry.get("etag") and etag:
+            return entry["etag"] == etag
+        if entry.get("last_modified") and last_modified:
+            return entry["last_modified"] == last_modified
+        return True
+
+    def _organize_file(self, name, original_filename, source_path, is_zip_file, consume=True):
+        """Organizes a single asset into the staging tree.
+
+        Archive members are streamed straight to their final paths, and anything already
+        staged with the same content is left untouched. consume=False means source_path
+        is an asset store blob or an HttpRangeFile, which must not be moved or deleted.
+        Returns {staged path: sha256}.
+        """
+        self.log_message(f"Organizing: {original_filename}")
+        written = {}
+        try:
+            if isinstance(source_path, str) and not os.path.exists(source_path):
+                self.log_message(f"Skipping {original_filename}: Temporary file not found.")
+                return written
+
+            if is_zip_file:
+                with zipfile.ZipFile(source_path, 'r') as zf:
+                    for info, target in self._archive_targets(name, zf):
+                        self.cancel_token.check("organize")
+                        written[target] = self._extract_member(zf, info, target)
+                self.log_message(f"Organized {len(written)} file(s) from {original_filename}.")
+                if consume:
+                    os.remove(source_path)
+            else:
+                final_dest_path = LUMA_PAYLOADS_FULL_PATH if original_filename.lower().endswith(".firm") else DOWNLOAD_DIR
+                final_path = os.path.join(final_dest_path, original_filename)
+                written[final_path] = self._install_file(original_filename, source_path, final_path, consume)
+                self.log_message(f"Moved '{original_filename}' to '{os.path.basename(final_dest_path)}/' folder.")
+
+        except RunCancelled:
+            raise
+        except Exception as e:
+            self.log_message(f"Error during organization of {original_filename}: {e}.")
+        return written
+
+    def _archive_targets(self, name, zf):
+        """Return (member info, staged path) for every archive member that belongs on the SD card."""
+        targets = []
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            member = info.filename
+            if name == "GodMode9":
+                if os.path.basename(member).lower() == "godmode9.firm":
+                    targets.append((info, os.path.join(LUMA_PAYLOADS_FULL_PATH, "GodMode9.firm")))
+                elif "gm9/scripts/" in member:
+                    targets.append((info, self._member_path(DOWNLOAD_DIR, member)))
+            elif name == "Luma3DS":
+                targets.append((info, self._member_path(DOWNLOAD_DIR, member)))
+        return targets
+
+    @staticmethod
+    def _member_path(base_dir, member):
+        """Map an archive member to a path under base_dir, dropping absolute and '..' parts like ZipFile.extract."""
+        parts = [part for part in member.replace("\\", "/").split("/")
+                 if part not in ("", ".", "..") and not part.endswith(":")]
+        return os.path.join(base_dir, *parts)
+
+    @staticmethod
+    def _file_checksums(path):
+        """Return (CRC32, SHA-256 hex) of a file in a single read."""
+        crc, sha256 = 0, hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(EXTRACT_BUFFER_SIZE), b""):
+                crc = zlib.crc32(block, crc)
+                sha256.update(block)
+        return crc, sha256.hexdigest()
+
+    def _staged_checksum(self, info, target):
+        """Return the SHA-256 of target if it already holds this archive member (same size and CRC32), else None."""
+        if os.path.isfile(target) and os.path.getsize(target) == info.file_size:
+            crc, sha256 = self._file_checksums(target)
+            if crc == info.CRC:
+                return sha256
+        return None
+
+    def _extract_member(self, zf, info, target):
+        """Stream one member to target unless the staged file already has its CRC32 and size.
+
+        Returns the member's SHA-256.
+        """
+        staged_sha256 = self._staged_checksum(info, target)
+        if staged_sha256:
+            self.metrics.increment("skipped_bytes", info.file_size)
+            return staged_sha256
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        sha256 = hashlib.sha256()
+        tmp_path = target + SYNC_TEMP_SUFFIX
+        try:
+            # ZipFile checks the CRC32 as the member is read, so a corrupt archive fails here
+            with zf.open(info) as src, open(tmp_path, 'wb') as dst:
+                for block in iter(lambda: src.read(EXTRACT_BUFFER_SIZE), b""):
+                    self.cancel_token.check("organize")
+                    dst.write(block)
+                    sha256.update(block)
+            os.replace(tmp_path, target)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.metrics.increment("bytes", info.file_size)
+        self.log_message(f"Extracted {info.filename} to {os.path.dirname(target)}")
+        return sha256.hexdigest()
+
+    def _install_file(self, filename, source_path, final_path, consume):
+        """Put a plain (non-archive) asset at final_path unless it is already there. Returns its SHA-256."""
+        with self.manifest_lock:
+            asset = dict(self.run_manifest["assets"].get(filename, {}))
+        sha256, size = asset.get("sha256"), asset.get("size")
+        if sha256 and os.path.isfile(final_path) and os.path.getsize(final_path) == size \
+                and self._file_checksums(final_path)[1] == sha256:
+            self.metrics.increment("skipped_bytes", size)
+            if consume:
+                os.remove(source_path)
+            return sha256
+
+        if consume:
+            # A rename within the same drive; nothing is rewritten
+            shutil.move(source_path, final_path)
+        else:
+            tmp_path = final_path + SYNC_TEMP_SUFFIX
+            try:
+                shutil.copyfile(source_path, tmp_path)
+                os.replace(tmp_path, final_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            self.metrics.increment("bytes", os.path.getsize(final_path))
+        return sha256 or file_sha256(final_path)
+
+    def _verify_files(self, verified=()):
+        """Verifies that critical files exist in their final locations.
+
+        Files already verified by the pipeline as their asset landed are not re-checked
+        for presence, but every file staged this run is re-hashed against the run manifest.
+        Returns the critical files that are missing plus the staged files that don't match.
+        """
+        missing = []
+        for repo_name in self.repositories:
+            for name, path in CRITICAL_FILES.get(repo_name, {}).items():
+                if name in verified:
+                    continue
+                if os.path.exists(path):
+                    self.log_message(f"Verification: {name} found. OK.")
+                else:
+                    self.log_message(f"WARNING: {name} NOT FOUND. Manual check needed!")
+                    missing.append(name)
+        if verified:
+            self.log_message(f"{len(verified)} critical file(s) were verified as they were organized.")
+
+        # Re-hash everything staged this run against the hashes recorded as it was written;
+        # files kept from the last build were re-hashed when they were kept
+        with self.manifest_lock:
+            staged = {rel_path: entry for rel_path, entry in self.run_manifest["files"].items()
+                      if rel_path not in self.carried_files}
+        corrupt = []
+        for rel_path, entry in staged.items():
+            path = os.path.join(DOWNLOAD_DIR, *rel_path.split("/"))
+            try:
+                ok = os.path.getsize(path) == entry["size"] and file_sha256(path) == entry["sha256"]
+            except OSError:
+                ok = False
+            if not ok:
+                self.log_message(f"ERROR: Staged file {rel_path} does not match its recorded SHA-256!")
+                corrupt.append(rel_path)
+        if staged:
+            self.log_message(f"Verified SHA-256 of {len(staged) - len(corrupt)} of {len(staged)} staged file(s).")
+        return missing + corrupt
+
+    def _copy_to_destinations(self):
+        """Sync the staging directory to every configured destination in parallel.
+
+        Each destination is planned, written and verified independently, so one failing
+        card does not affect the others. Destinations on the same device share a single
+        writer so a card is never written by two threads at once. Returns a per-destination
+        summary dict.
+        """
+        results = {}
+        destinations = []
+        for destination_dir in self.output_dirs:
+            if os.path.isdir(destination_dir):
+                destinations.append(destination_dir)
+            else:
+                self.log_message(f"ERROR: Output directory '{destination_dir}' is not available, skipping it.")
+                results[destination_dir] = {"ok": False, "written": 0, "skipped": 0, "error": "not available"}
+        if not destinations:
+            return results
+
+        self.log_message(f"\n--- Copying files to {len(destinations)} destination(s) ---")
+        self.update_status("Comparing with destination(s)...")
+        mb = 1024 * 1024
+        syncs, plans = {}, {}
+        with ThreadPoolExecutor(max_workers=len(destinations), thread_name_prefix="spdl-plan") as executor:
+            futures = {executor.submit(self._plan_destination, destination_dir): destination_dir
+                       for destination_dir in destinations}
+            for future, destination_dir in futures.items():
+                try:
+                    syncs[destination_dir], plans[destination_dir] = future.result()
+                except OSError as e:
+                    self.log_message(f"ERROR: Failed to compare files with {destination_dir}: {e}")
+                    results[destination_dir] = {"ok": False, "written": 0, "skipped": 0, "error": str(e)}
+
+        pending = {}
+        for destination_dir, plan in plans.items():
+            self.log_message(f"Sync plan for {destination_dir}: {len(plan['copy'])} file(s) to write "
+                             f"({plan['bytes_to_write']/mb:.2f} MB), {len(plan['skip'])} unchanged file(s) "
+                             f"skipped ({plan['bytes_skipped']/mb:.2f} MB).")
+            if plan["copy"]:
+                pending[destination_dir] = plan
+            else:
+                self.log_message(f"{destination_dir} is already up to date.")
+                results[destination_dir] = {"ok": True, "written": 0, "skipped": plan["bytes_skipped"], "error": None}
+        if not pending:
+            self.update_status("Destination(s) already up to date.")
+            return results
+
+        # Time the user spends deciding doesn't count against the copy budget or the run's deadline
+        with self.cancel_token.paused():
+            confirmed = not self.confirm or self.confirm(pending)
+        if not confirmed:
+            self.log_message("Copy to destination cancelled.")
+            self.update_status("Copy cancelled.")
+            for destination_dir in pending:
+                results[destination_dir] = {"ok": False, "written": 0, "skipped": 0, "error": "cancelled"}
+            return results
+
+        # One writer per physical device; destinations on the same device are written in turn
+        devices = {}
+        for destination_dir in pending:
+            devices.setdefault(os.stat(destination_dir).st_dev, []).append(destination_dir)
+        self.destination_progress = {destination_dir: [0, plan["bytes_to_write"], "writing"]
+                                     for destination_dir, plan in pending.items()}
+        self.update_status(f"Copying to {len(pending)} destination(s) on {len(devices)} device(s)...")
+        with ThreadPoolExecutor(max_workers=len(devices), thread_name_prefix="spdl-writer") as executor:
+            futures = [executor.submit(self._write_device, device_dirs, syncs, pending)
+                       for device_dirs in devices.values()]
+            for future in futures:
+                results.update(future.result())
+
+        # A cancelled copy is not an error to alert the user about
+        failed = [destination_dir for destination_dir, summary in results.items()
+                  if not summary["ok"] and not summary.get("cancelled")]
+        if failed:
+            self.update_status(f"Copy failed for {len(failed)} of {len(results)} destination(s)!")
+            if self.on_error:
+                self.on_error("Copy Error", "Failed to copy files to:\n" + "\n".join(
+                    f"{destination_dir}: {results[destination_dir]['error']}" for destination_dir in failed))
+        elif self.cancel_token.is_cancelled():
+            self.update_status("Copy cancelled.")
+        else:
+            self.update_status("Copy complete!")
+        return results
+
+    def _plan_destination(self, destination_dir):
+        with self.metrics.span("copy", f"plan {destination_dir}") as span:
+            with self.manifest_lock:
+                staged_hashes = dict(self.run_manifest["files"])
+            if self.bundle:
+                sync = BundleSync(self.bundle, destination_dir, cancel_token=self.cancel_token)
+            else:
+                sync = DestinationSync(DOWNLOAD_DIR, destination_dir, staged_hashes=staged_hashes,
+                                       cancel_token=self.cancel_token)
+            plan = sync.plan()
+            span["files"] = len(plan["copy"])
+        return sync, plan
+
+    def _write_device(self, destination_dirs, syncs, plans):
+        """Writer thread for one device: sync and verify each of its destinations in turn."""
+        return {destination_dir: self._write_destination(syncs[destination_dir], plans[destination_dir])
+                for destination_dir in destination_dirs}
+
+    def _write_destination(self, sync, plan):
+        """Write and verify one destination. Errors are contained to this destination."""
+        destination_dir = sync.destination_dir
+        with self.metrics.span("copy", destination_dir, skipped_bytes=plan["bytes_skipped"]) as span:
+            summary = self._sync_destination(sync, plan)
+            span["bytes"] = summary["written"]
+            if summary["error"]:
+                span["error"] = summary["error"]
+        return summary
+
+    def _sync_destination(self, sync, plan):
+        """Apply and read back a destination's sync plan."""
+        destination_dir = sync.destination_dir
+        mb = 1024 * 1024
+        try:
+            written = sync.apply(plan, progress=lambda rel_path, done, total:
+                                 self._report_destination_progress(destination_dir, done, "writing"))
+            self._report_destination_progress(destination_dir, written, "verifying")
+            mismatched = sync.verify(plan)
+            if mismatched:
+                raise OSError(f"verification failed for {len(mismatched)} file(s): {', '.join(mismatched[:5])}")
+            self._report_destination_progress(destination_dir, written, "done")
+            self.log_message(f"Successfully copied files to {destination_dir}: "
+                             f"{written/mb:.2f} MB written, {plan['bytes_skipped']/mb:.2f} MB skipped, verified OK.")
+            return {"ok": True, "written": written, "skipped": plan["bytes_skipped"], "error": None}
+        except RunCancelled as e:
+            self._report_destination_progress(destination_dir, None, "cancelled")
+            self.log_message(f"Copy to {destination_dir} stopped: {e}. Files written so far are complete.")
+            return {"ok": False, "written": 0, "skipped": plan["bytes_skipped"], "error": str(e), "cancelled": True}
+        except Exception as e:
+            self._report_destination_progress(destination_dir, None, "failed")
+            self.log_message(f"ERROR: Failed to copy files to {destination_dir}: {e}")
+            return {"ok": False, "written": 0, "skipped": plan["bytes_skipped"], "error": str(e)}
+
+    def _report_destination_progress(self, destination_dir, written, state):
+        """Update one destination's progress and refresh the combined progress display."""
+        with self.progress_lock:
+            entry = self.destination_progress[destination_dir]
+            if written is not None:
+                entry[0] = written
+            entry[2] = state
+            overall_done = sum(done for done, _, _ in self.destination_progress.values())
+            overall_total = sum(total for _, total, _ in self.destination_progress.values())
+            parts = []
+            for path, (done, total, entry_state) in self.destination_progress.items():
+                label = os.path.basename(os.path.normpath(path)) or path
+                if entry_state == "writing":
+                    parts.append(f"{label}: {done / total * 100 if total else 100:.0f}%")
+                else:
+                    parts.append(f"{label}: {entry_state}")
+        self.update_progress(overall_done / overall_total * 100 if overall_total else 100, "  |  ".join(parts))
+
+
+class MirrorServer:
+    """Serves this instance's release info and asset store to other instances on the LAN.
+
+    GET /repos/<owner>/<repo>/releases/latest returns the cached release info in the
+    REST API's shape, and GET /assets/<asset id> returns the asset itself, both with
+    ETags; assets also support Range and If-Range so downloads resume and split into
+    segments as they do against GitHub. Anything not cached yet is fetched from GitHub
+    first through the engine's own cache and asset store, so each release crosses the
+    WAN once for every station using the mirror. Only the starter pack's repositories
+    and their assets are served.
+    """
+
+    def __init__(self, engine, host="", port=MIRROR_PORT):
+        from http.server import ThreadingHTTPServer
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def serve_forever(self):
+        """Serve until shutdown() is called or the process is interrupted."""
+        self.engine._open_clients(long_lived=True)
+        os.makedirs(TEMP_DIR, exist_ok=True)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.engine._flush_cache()
+            self.engine._save_asset_store()
+            self.engine.http.close()
+
+    def shutdown(self):
+        self.server.shutdown()
+
+    def release_json(self, owner, repo):
+        """Return (body, etag) for a repository's latest release, or None if it is unknown or unavailable."""
+        details = next((details for details in REPOSITORIES.values()
+                        if (details["owner"].lower(), details["repo"].lower()) == (owner.lower(), repo.lower())), None)
+        if not details:
+            return None
+        urls, _, _ = self.engine._get_latest_release_asset_urls(details["owner"], details["repo"],
+                                                                details["download_filename_patterns"])
+        self.engine._flush_cache()
+        entry = self.engine.cache_data.get(f"{details['owner']}/{details['repo']}")
+        if not (urls and entry):
+            return None
+        count = len(entry["urls"])
+        assets = [{"name": filename, "browser_download_url": url, "id": asset_id, "digest": digest, "size": size}
+                  for url, filename, asset_id, digest, size in zip(
+                      entry["urls"], entry["filenames"], entry.get("asset_ids") or [None] * count,
+                      entry.get("digests") or [None] * count, entry.get("sizes") or [None] * count)]
+        body = json.dumps({"tag_name": entry.get("tag"), "assets": assets}).encode("utf-8")
+        # GitHub's ETag identifies the same release, so clients can revalidate against either
+        return body, entry.get("etag") or f'"{hashlib.sha1(body).hexdigest()}"'
+
+    def asset_path(self, asset_id):
+        """Return the stored blob for a release asset, downloading it from GitHub first if needed."""
+        found = None
+        with self.engine.cache_lock:
+            for entry in self.engine.cache_data.values():
+                if asset_id in (entry.get("asset_ids") or []):
+                    found = entry
+                    break
+        if not found:
+            return None
+        self.engine._cached_assets(found)
+        index = found["asset_ids"].index(asset_id)
+        url, filename = found["urls"][index], found["filenames"][index]
+        store_key = AssetStore.asset_key(url, found["asset_ids"][index])
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(store_key, threading.Lock())
+        # Stations asking for the same missing asset at once share a single download
+        with key_lock:
+            path = self.engine.asset_store.lookup(store_key)
+            if path:
+                return path
+            temp_filepath = self.engine._download_file(url, filename, TEMP_DIR)
+            if not temp_filepath:
+                return None
+            self.engine._add_to_store(store_key, temp_filepath, filename)
+            os.remove(temp_filepath)
+            self.engine._save_asset_store()
+            return self.engine.asset_store.lookup(store_key)
+
+    def _handler(self):
+        from http.server import BaseHTTPRequestHandler
+        mirror = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                mirror.engine.log_message(f"Mirror: {self.address_string()} {format % args}")
+
+            def send_body(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for header, value in headers:
+                    self.send_header(header, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parts = [part for part in urlsplit(self.path).path.split("/") if part]
+                try:
+                    if len(parts) == 5 and parts[0] == "repos" and parts[3:] == ["releases", "latest"]:
+                        self.send_release(parts[1], parts[2])
+                    elif len(parts) == 2 and parts[0] == "assets" and parts[1].isdigit():
+                        self.send_asset(int(parts[1]))
+                    else:
+                        self.send_body(404, b"Not Found")
+                except OSError as e:
+                    mirror.engine.log_message(f"Mirror: ERROR serving {self.path}: {e}")
+                    self.close_connection = True
+
+            def send_release(self, owner, repo):
+                release = mirror.release_json(owner, repo)
+                if not release:
+                    self.send_body(404, b"Not Found")
+                    return
+                body, etag = release
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_body(304, headers=[("ETag", etag)])
+                    return
+                self.send_body(200, body, headers=[("Content-Type", "application/json"), ("ETag", etag)])
+
+            def send_asset(self, asset_id):
+                path = mirror.asset_path(asset_id)
+                if not path:
+                    self.send_body(404, b"Not Found")
+                    return
+                # Blobs are named by their SHA-256
+                etag = f'"{os.path.basename(path)}"'
+                with open(path, 'rb') as f:
+                    size = os.fstat(f.fileno()).st_size
+                    start, end, partial = self.requested_range(size, etag)
+                    if start is None:
+                        self.send_body(416, headers=[("Content-Range", f"bytes */{size}")])
+                        return
+                    self.send_response(206 if partial else 200)
+                    self.send_header("Content-Type", "application/octet-stream")
+                    self.send_header("Content-Length", str(end - start + 1))
+                    self.send_header("Accept-Ranges", "bytes")
+                    self.send_header("ETag", etag)
+                    if partial:
+                        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+                    self.end_headers()
+                    f.seek(start)
+                    remaining = end - start + 1
+                    while remaining > 0:
+                        block = f.read(min(EXTRACT_BUFFER_SIZE, remaining))
+                        if not block:
+                            break
+                        self.wfile.write(block)
+                        remaining -= len(block)
+
+            def requested_range(self, size, etag):
+                """Return (start, end, partial) of the bytes to send, end inclusive; start is None if unsatisfiable."""
+                whole = (0, size - 1, False)
+                range_header = self.headers.get("Range", "")
+                if_range = self.headers.get("If-Range")
+                if not range_header.startswith("bytes=") or (if_range and if_range != etag):
+                    return whole
+                first, _, last = range_header[len("bytes="):].split(",")[0].strip().partition("-")
+                try:
+                    if first:
+                        start, end = int(first), min(int(last), size - 1) if last else size - 1
+                    else:
+                        start, end = max(0, size - int(last)), size - 1
+                except ValueError:
+                    return whole
+                if start >= size or start > end:
+                    return None, None, False
+                return start, end, True
+
+        return Handler
+
+
+class JsonProgressReporter:
+    """Writes engine callbacks to a stream as JSON lines for the headless CLI."""
+
+    PROGRESS_INTERVAL = 0.25  # Seconds between progress events, so pipes are not flooded
+
+    def __init__(self, stream=sys.stdout):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.last_progress = 0.0
+
+    def emit(self, event, **fields):
+        record = {"event": event, "time": datetime.now().isoformat(timespec='seconds'), **fields}
+        with self.lock:
+            self.stream.write(json.dumps(record) + "\n")
+            self.stream.flush()
+
+    def log(self, message):
+        self.emit("log", message=message.strip())
+
+    def status(self, text):
+        self.emit("status", status=text)
+
+    def progress(self, value, text=""):
+        now = time.monotonic()
+        if value < 100 and now - self.last_progress < self.PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        self.emit("progress", percent=round(value, 1), text=text)
+
+    def error(self, title, message):
+        self.emit("error", title=title, message=message)
+
+    def rate_limit(self, resource, remaining, limit, reset):
+        self.emit("rate_limit", resource=resource, remaining=remaining, limit=limit, reset=reset)
+
+
+@contextmanager
+def cancel_on_stop_signals(engine, reporter):
+    """Cancel the engine's run on SIGINT or SIGTERM, so it cleans up and reports instead of dying mid-write.
+
+    A second signal is handled as usual, for when the run does not stop quickly enough.
+    """
+    previous = {}
+
+    def restore():
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        previous.clear()
+
+    def stop(signum, frame):
+        restore()
+        name = signal.Signals(signum).name
+        reporter.log(f"Received {name}, stopping the run. Send it again to exit immediately.")
+        engine.cancel(f"Interrupted by {name}")
+
+    # Signal handlers can only be installed from the main thread
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            previous[signum] = signal.signal(signum, stop) or signal.SIG_DFL
+    try:
+        yield
+    finally:
+        restore()
+
+
+def main(argv=None):
+    """Headless command-line entry point. Emits JSON lines on stdout and never loads Tk."""
+    parser = argparse.ArgumentParser(
+        prog="3DS-SPDL --headless",
+        description="Download and organize the 3DS starter pack without the GUI.")
+    parser.add_argument("--headless", action="store_true", help="Accepted for compatibility with 3DS-SPDL.py.")
+    parser.add_argument("--repos", help=f"Comma-separated repositories to fetch (default: {','.join(REPOSITORIES)}).")
+    parser.add_argument("--output-dir", action="append", default=[],
+                        help="Destination to sync the pack to, e.g. an SD card root. Repeat for several cards.")
+    parser.add_argument("--token-env", default=TOKEN_ENV_VAR,
+                        help=f"Environment variable holding a GitHub PAT (default: {TOKEN_ENV_VAR}).")
+    parser.add_argument("--concurrency", type=int, help="Maximum concurrent requests and downloads.")
+    parser.add_argument("--lock-mode", choices=("update", "pin"),
+                        help=f"'update' builds the latest releases and records them in {LOCK_FILE}; "
+                             "'pin' rebuilds exactly the releases it records (default: 'lock_mode' in the config, or update).")
+    parser.add_argument("--deadline", type=float, metavar="SECONDS",
+                        help=f"Abort the run if it takes longer than this; 0 for no limit (default: 'run_deadline' "
+                             f"in the config, or {RUN_DEADLINE}).")
+    parser.add_argument("--mirror", metavar="URL",
+                        help="LAN mirror to fetch from before GitHub, e.g. http://bench-1:8765 (default: 'mirror_url' in the config).")
+    parser.add_argument("--serve-mirror", nargs="?", type=int, const=MIRROR_PORT, metavar="PORT",
+                        help=f"Serve release info and assets to other instances on the LAN (default port: {MIRROR_PORT}).")
+    parser.add_argument("--mirror-host", default="",
+                        help="Address to serve the mirror on (default: all interfaces).")
+    parser.add_argument("--export-bundle", nargs="?", const=BUNDLE_DIR, metavar="DIR",
+                        help=f"After the run, write the pack to a single bundle named by its release set and copy it "
+                             f"to DIR (default: keep it in {BUNDLE_DIR}).")
+    parser.add_argument("--import-bundle", metavar="FILE",
+                        help="Sync a bundle made with --export-bundle onto the --output-dir destinations "
+                             "instead of downloading anything.")
+    args = parser.parse_args(argv)
+
+    repositories = REPOSITORIES
+    if args.repos:
+        names = [name.strip() for name in args.repos.split(",") if name.strip()]
+        unknown = [name for name in names if name not in REPOSITORIES]
+        if unknown:
+            parser.error(f"unknown repositories: {', '.join(unknown)} (choose from {', '.join(REPOSITORIES)})")
+        repositories = {name: REPOSITORIES[name] for name in names}
+    for output_dir in args.output_dir:
+        if not os.path.isdir(output_dir):
+            parser.error(f"output directory does not exist: {output_dir}")
+    if args.import_bundle and not args.output_dir:
+        parser.error("--import-bundle needs at least one --output-dir")
+    if args.export_bundle and not os.path.isdir(args.export_bundle) and args.export_bundle != BUNDLE_DIR:
+        parser.error(f"bundle export directory does not exist: {args.export_bundle}")
+
+    reporter = JsonProgressReporter()
+    try:
+        config = load_config()
+    except (json.JSONDecodeError, IOError) as e:
+        reporter.log(f"Ignoring unreadable {CONFIG_FILE}: {e}")
+        config = {}
+    if args.concurrency:
+        config['max_concurrent_downloads'] = args.concurrency
+    if args.mirror is not None:
+        config['mirror_url'] = args.mirror
+    if args.lock_mode:
+        config['lock_mode'] = args.lock_mode
+    if args.deadline is not None:
+        config['run_deadline'] = args.deadline
+
+    engine = UpdateEngine(
+        config=config,
+        token=os.environ.get(args.token_env) or config.get('github_pat', ""),
+        output_dirs=args.output_dir,
+        repositories=repositories,
+        log=reporter.log,
+        status=reporter.status,
+        progress=reporter.progress,
+        error=reporter.error,
+        rate_limit=reporter.rate_limit,
+    )
+    if args.serve_mirror is not None:
+        # A mirror talks to GitHub itself; chaining it to another mirror is not supported
+        config.pop('mirror_url', None)
+        try:
+            mirror = MirrorServer(engine, host=args.mirror_host, port=args.serve_mirror)
+        except OSError as e:
+            reporter.error("Mirror", f"Could not serve on port {args.serve_mirror}: {e}")
+            return 1
+        reporter.emit("mirror", host=args.mirror_host or "0.0.0.0", port=mirror.port)
+        reporter.log(f"Serving LAN mirror on port {mirror.port}. Press Ctrl+C to stop.")
+        try:
+            mirror.serve_forever()
+        except KeyboardInterrupt:
+            reporter.log("Mirror stopped.")
+        return 0
+    if args.import_bundle:
+        with cancel_on_stop_signals(engine, reporter):
+            result = engine.import_bundle(args.import_bundle)
+        reporter.emit("result", **result)
+        return 0 if result["ok"] else 1
+    with cancel_on_stop_signals(engine, reporter):
+        result = engine.run()
+    if args.export_bundle and result["ok"]:
+        try:
+            result["bundle"] = engine.export_bundle(args.export_bundle)
+            reporter.emit("bundle", path=result["bundle"])
+        except (OSError, ValueError) as e:
+            reporter.error("Bundle", f"Could not export the bundle: {e}")
+            result["ok"] = False
+            result["error"] = str(e)
+    reporter.emit("result", **result)
+    return 0 if result["ok"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())